@@ -0,0 +1,37 @@
+"""
+Measures the memory held by each model instance, for a queryset of User rows.
+Needs no database; the rows are created in place of a query result.
+
+Usage: python -m benchmarks.instance_memory [-n ROWS]
+"""
+
+import tracemalloc
+from argparse import ArgumentParser
+from models import User, NotSQLGroup
+from resources.init import _add_metadata
+
+
+def bytes_per_instance(queryset, count: int) -> float:
+    """ :return: Bytes still allocated per instance, after creating instances of every row the way evaluate() does. """
+    name = 'benchmark'  # Shared between rows, such that only the instances themselves are measured.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # Like the rows of fetchall(), each row is only kept alive by the instance created from it, if at all.
+    instances = queryset._instances((pk, name, 30, 1) for pk in range(1_000, 1_000 + count))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(instances) == count
+    return (after - before) / count
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--rows', type=int, default=100_000)
+    options = parser.parse_args()
+
+    for model in (NotSQLGroup, User):
+        _add_metadata(model, 'benchmark', None)
+
+    print(f"User, {options.rows} rows")
+    print(f"  objects:            {bytes_per_instance(User.objects, options.rows):8.1f} bytes per instance")
+    print(f"  objects.readonly(): {bytes_per_instance(User.objects.readonly(), options.rows):8.1f} bytes per instance")
@@ -0,0 +1,313 @@
+"""
+Times the main paths of the ORM against a database, and reports the results as JSON;
+such that the results of a run may be compared against those of an earlier one.
+
+Usage: python -m benchmarks.suite [-b sqlite] [-p PASSWORD] [--only NAME ...] [-o results.json] [--compare baseline.json]
+
+Every benchmark runs in the database given by --database, which is dropped and created again for the run;
+or in an in-memory SQLite database with --backend sqlite, which needs no server.
+Each result holds the operations per second (rows hydrated, rows saved or tables created),
+the 50th and 99th percentile of the seconds per repetition, and the peak RSS of the process after the benchmark.
+The peak RSS only grows during a run, use --only to measure a single benchmark.
+"""
+
+import gc
+import sys
+import json
+import sqlite3
+import platform
+from math import ceil
+from mysql import connector
+from getpass import getpass
+from datetime import datetime
+from time import perf_counter
+from contextlib import contextmanager
+from argparse import ArgumentParser, Namespace
+from typing import Any, Callable, ContextManager, Iterator, NamedTuple
+from models import User, NotSQLGroup
+from resources.orm import DBModel
+from resources.modelfields import StringField
+from resources.init import connect_orm, create_tables
+from resources.utils import ConnectionSingleton, DatabaseConnection
+from resources.backends import SQLITE
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:  # Windows
+    getrusage = None
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    repeat: int  # Number of timed repetitions.
+    ops: int  # Operations per repetition.
+    ops_per_second: float
+    p50: float  # Seconds per repetition.
+    p99: float
+    peak_rss: int | None  # Bytes, None where unsupported.
+
+
+# Maps the name of each benchmark to a context manager, which prepares it and yields the operation to time,
+# and the number of operations performed by each call.
+Benchmark = Callable[[DatabaseConnection, Namespace], ContextManager[tuple[Callable[[], Any], int]]]
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Callable[[DatabaseConnection, Namespace], Iterator[tuple[Callable[[], Any], int]]]], Benchmark]:
+    """ Registers the decorated generator as a benchmark, in the order they are run. """
+    def decorator(func: Callable[[DatabaseConnection, Namespace], Iterator[tuple[Callable[[], Any], int]]]) -> Benchmark:
+        BENCHMARKS[name] = wrapped = contextmanager(func)
+        return wrapped
+    return decorator
+
+
+def _populate(options: Namespace) -> None:
+    """ Replaces the rows of the benchmark database with options.rows users, spread over a tenth as many groups. """
+    User.objects.delete()
+    NotSQLGroup.objects.delete()
+    groups = NotSQLGroup.objects.bulk_create(NotSQLGroup(name=f"group{i}") for i in range(max(1, options.rows // 10)))
+    User.objects.bulk_create(User(name=f"user{i}", age=i, group=groups[i % len(groups)]) for i in range(options.rows))
+
+
+@benchmark('hydrate')
+def hydrate(connection: DatabaseConnection, options: Namespace):
+    """ Selecting every row, and creating its instance. """
+    _populate(options)
+    yield (lambda: User.objects.evaluate()), options.rows
+
+
+@benchmark('filter')
+def filter_rows(connection: DatabaseConnection, options: Namespace):
+    """ Selecting half of the rows by a condition. """
+    _populate(options)
+    threshold = options.rows - options.rows // 2
+    yield (lambda: User.objects.filter(age__gte=threshold).evaluate()), options.rows // 2
+
+
+@benchmark('fk_lazy')
+def fk_lazy(connection: DatabaseConnection, options: Namespace):
+    """ Reading a foreign key of every row, querying the related row each time. """
+    _populate(options)
+
+    def traverse() -> None:
+        for user in User.objects:
+            user.group
+
+    yield traverse, options.rows
+
+
+@benchmark('fk_select_related')
+def fk_select_related(connection: DatabaseConnection, options: Namespace):
+    """ Reading a foreign key of every row, with the related rows joined into the query. """
+    _populate(options)
+
+    def traverse() -> None:
+        for user in User.objects.select_related('group'):
+            user.group
+
+    yield traverse, options.rows
+
+
+@benchmark('save_insert')
+def save_insert(connection: DatabaseConnection, options: Namespace):
+    """ Inserting rows one save() at a time. """
+    _populate(options)
+
+    def insert() -> None:
+        for i in range(options.writes):
+            User(name=f"new{i}", age=i).save()
+
+    yield insert, options.writes
+
+
+@benchmark('bulk_create')
+def bulk_create(connection: DatabaseConnection, options: Namespace):
+    """ Inserting rows in batches. """
+    _populate(options)
+    yield (lambda: User.objects.bulk_create(User(name=f"new{i}", age=i) for i in range(options.writes))), options.writes
+
+
+@benchmark('save_update')
+def save_update(connection: DatabaseConnection, options: Namespace):
+    """ Saving a changed field of each instance. """
+    _populate(options)
+    users = list(User.objects.filter(age__lt=options.writes))
+    calls = 0
+
+    def update() -> None:
+        nonlocal calls
+        calls += 1
+        for user in users:
+            user.age = calls
+            user.save()
+
+    yield update, len(users)
+
+
+@benchmark('save_unchanged')
+def save_unchanged(connection: DatabaseConnection, options: Namespace):
+    """ Saving instances assigned the values they already had, which the snapshot diff skips. """
+    _populate(options)
+    users = list(User.objects.filter(age__lt=options.writes))
+
+    def update() -> None:
+        for user in users:
+            user.age = user.age
+            user.save()
+
+    yield update, len(users)
+
+
+@benchmark('create_tables')
+def create_model_tables(connection: DatabaseConnection, options: Namespace):
+    """ Creating the tables of options.models models, each with a foreign key to the one before, in a new database. """
+    # The models are registered for the rest of the process, but only their own databases hold tables for them.
+    previous = NotSQLGroup
+    for i in range(options.models):
+        previous = type(f"Benchmark{i}", (DBModel,), {'name': StringField(64), 'value': 0, 'previous': previous})
+
+    # Every repetition gets a connection of its own, opened in advance; a new SQLite database is a new connection.
+    connections = [DatabaseConnection(connect(options)) for _ in range(options.warmup + options.repeat)]
+    databases = [f"{options.database}_tables{i}" for i in range(len(connections))]
+    created = 0
+
+    def create() -> None:
+        nonlocal created
+        create_tables(connections[created], databases[created])
+        created += 1
+
+    try:
+        yield create, options.models
+    finally:
+        for temporary, database in zip(connections, databases):
+            temporary.backend.drop_database(temporary.cursor, database)
+            temporary.close()
+        connect_orm(connection, options.database)  # create_tables() pointed every model at the last database.
+
+
+def _percentile(samples: list[float], percentile: float) -> float:
+    """ :return: The nearest-rank percentile of the samples. """
+    ordered = sorted(samples)
+    return ordered[max(0, ceil(percentile / 100 * len(ordered)) - 1)]
+
+
+def _peak_rss() -> int | None:
+    if getrusage is None:
+        return None
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes.
+
+
+def measure(name: str, connection: DatabaseConnection, options: Namespace) -> BenchmarkResult:
+    """ Runs the named benchmark options.warmup times untimed, then options.repeat times timed. """
+    with BENCHMARKS[name](connection, options) as (operation, ops):
+        for _ in range(options.warmup):
+            operation()
+
+        samples = []
+        for _ in range(options.repeat):
+            gc.collect()
+            started = perf_counter()
+            operation()
+            samples.append(perf_counter() - started)
+
+    return BenchmarkResult(name, options.repeat, ops, ops * len(samples) / sum(samples),
+                           _percentile(samples, 50), _percentile(samples, 99), _peak_rss())
+
+
+def run(connection: DatabaseConnection, options: Namespace) -> dict[str, Any]:
+    """ Runs the benchmarks in a database created for the run. """
+    connection.backend.drop_database(connection.cursor, options.database)
+    create_tables(connection, options.database)
+    connect_orm(connection, options.database)
+
+    results = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'server': connection.server_info(),
+        'options': {option: getattr(options, option) for option in ('rows', 'writes', 'models', 'repeat', 'warmup')},
+        'results': [],
+    }
+    try:
+        for name in options.only or BENCHMARKS:
+            result = measure(name, connection, options)
+            print(f"{name:<18} {result.ops_per_second:>12.1f} ops/s  p50 {result.p50 * 1000:9.2f} ms  "
+                  f"p99 {result.p99 * 1000:9.2f} ms", file=sys.stderr)
+            results['results'].append(result._asdict())
+    finally:
+        if not options.keep:
+            connection.backend.drop_database(connection.cursor, options.database)
+
+    return results
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> float:
+    """
+    Prints the change in operations per second of each benchmark, relative to the baseline.
+    :return: The largest regression, in percent.
+    """
+    before = {result['name']: result['ops_per_second'] for result in baseline['results']}
+    worst = 0.0
+    for result in results['results']:
+        if result['name'] not in before:
+            continue
+        change = (result['ops_per_second'] / before[result['name']] - 1) * 100
+        worst = max(worst, -change)
+        print(f"{result['name']:<18} {before[result['name']]:>12.1f} -> {result['ops_per_second']:>12.1f} ops/s  ({change:+.1f}%)",
+              file=sys.stderr)
+    return worst
+
+
+def connect(options: Namespace) -> Any:
+    """ :return: A new connection to the database server, or a new in-memory SQLite database. """
+    if options.backend == SQLITE.name:
+        return sqlite3.connect(':memory:', check_same_thread=False)
+    return connector.connect(host=options.host, port=options.port, user=options.user, passwd=options.password)
+
+
+def get_options() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-b', '--backend', choices=('mysql', 'sqlite'), default='mysql')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('-u', '--user', default='root')
+    parser.add_argument('-p', '--password', default=None)
+    parser.add_argument('-d', '--database', default='myqueryorm_benchmark', help="Dropped and created again for the run")
+    parser.add_argument('--keep', action='store_true', help="Keep the database after the run")
+    parser.add_argument('--rows', type=int, default=1000, help="Rows selected by the reading benchmarks")
+    parser.add_argument('--writes', type=int, default=200, help="Rows saved by the writing benchmarks")
+    parser.add_argument('--models', type=int, default=100, help="Models created by the create_tables benchmark")
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    parser.add_argument('-w', '--warmup', type=int, default=2)
+    parser.add_argument('--only', nargs='+', choices=tuple(BENCHMARKS), help="Run these benchmarks, rather than all")
+    parser.add_argument('-o', '--output', help="Write the results to this file, rather than stdout")
+    parser.add_argument('--compare', help="Results of an earlier run, to compare against")
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help="Exit with status 1 when a benchmark is this many percent slower than in --compare")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    options = get_options()
+    if options.backend != SQLITE.name and options.password is None:
+        options.password = getpass('Password: ')
+
+    connection = ConnectionSingleton(connect(options))
+    try:
+        results = run(connection, options)
+    finally:
+        connection.close()
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if options.compare:
+        with open(options.compare) as file:
+            regression = compare(results, json.load(file))
+        if options.max_regression is not None and regression > options.max_regression:
+            raise SystemExit(1)
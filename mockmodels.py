@@ -7,5 +7,5 @@ class NotSQLGroup(DBModel):
 
 
 class User(DBModel):
-    name: str = StringField(64)
+    name: str = StringField(64, index=True)
     group: DBModel = NotSQLGroup
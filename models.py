@@ -9,6 +9,6 @@ class NotSQLGroup(DBModel):
 
 
 class User(DBModel):
-    name: str = StringField(64)
+    name: str = StringField(64, index=True)
     age: int = 0  # TODO Kevin: Should it be possible to create fields from annotations alone?
     group: DBModel = NotSQLGroup
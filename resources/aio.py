@@ -0,0 +1,46 @@
+"""
+Allows the ORM to be used from asyncio event loops, and to run independent queries concurrently.
+The blocking database calls are run on a bounded pool of worker threads, such that they never block the loop itself.
+Every worker checks out its own connection when the models use a ConnectionPool,
+while calls through the ConnectionSingleton are serialized by its lock.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run aio.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run aio.py instead of app.py. This, sadly, will not work :(")
+
+import asyncio
+from functools import partial
+from contextvars import copy_context
+from typing import Any, Callable, TypeVar
+from concurrent.futures import Future, ThreadPoolExecutor
+
+T = TypeVar('T')
+
+# Matches the default size of ConnectionPool, more workers would only wait for a connection.
+DEFAULT_MAX_WORKERS = 5
+
+_executor: ThreadPoolExecutor = None
+
+
+def set_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+    """
+    Replaces the worker threads used for database calls, preferably with as many as there are pooled connections.
+    Calls already running on the previous workers are allowed to finish.
+    """
+    global _executor
+    previous, _executor = _executor, ThreadPoolExecutor(max_workers, thread_name_prefix='MyQueryORM')
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def submit(func: Callable[..., T], *args: Any, **kwargs: Any) -> Future[T]:
+    """ Starts the blocking func on a worker thread, in a copy of the caller's context. """
+    if _executor is None:
+        set_executor()
+    return _executor.submit(copy_context().run, partial(func, *args, **kwargs))
+
+
+async def run_in_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """ Awaits the blocking func on a worker thread, in a copy of the caller's context. """
+    return await asyncio.wrap_future(submit(func, *args, **kwargs))
@@ -0,0 +1,347 @@
+"""
+Everything the ORM needs to know about the database engine it talks to; its connections, SQL dialect, introspection and DDL.
+The backend of a connection is picked from the type of the connection it wraps:
+
+    connection = ConnectionSingleton(sqlite3.connect('cache.db', check_same_thread=False))  # Uses SQLITE
+    pool = ConnectionPool(partial(sqlite3.connect, 'cache.db', check_same_thread=False), backend=SQLITE)
+
+SQLite keeps a single database per file, such that database names passed to connect_orm() and create_tables() only
+name the file the connection was opened with. Pass check_same_thread=False, as the ORM may use the connection from
+other threads, such as those of resources.aio and ConnectionPool.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run backends.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run backends.py instead of app.py. This, sadly, will not work :(")
+
+import sqlite3
+from unicodedata import combining, normalize
+from mysql.connector import DatabaseError as MySQLDatabaseError
+from typing import Any, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from resources.utils import DatabaseConnection
+
+# Prepared statements kept open per MySQL connection, the least recently used is closed when exceeded.
+# Well below the server's default max_prepared_stmt_count (16382), which is shared by all connections.
+MAX_PREPARED_STATEMENTS = 256
+
+
+class Backend:
+    """
+    Base class of the database engines supported by the ORM.
+    Statements are compiled with %s placeholders and database qualified table names, which backends translate as needed.
+    """
+
+    name: str
+    DatabaseError: type[Exception]  # Raised by the driver when a statement fails.
+    max_placeholders: int  # Maximum number of parameters of a single statement.
+    max_identifier_length: int
+    interleaved_results: bool  # Statements may run while the result of another is streamed over the same connection.
+
+    # Connections
+
+    def execute(self, connection: 'DatabaseConnection', sql: str, params: tuple[Any, ...]) -> Any:
+        """ :return: The cursor holding the result of the statement. """
+        raise NotImplementedError
+
+    def close(self, connection: 'DatabaseConnection') -> None:
+        connection.cursor.close()
+        connection.connection.close()
+
+    def consume_results(self, connection: Any) -> None:
+        """ Reads any result left unread on the connection, such that it may run the next statement. """
+
+    def begin(self, connection: Any) -> None:
+        raise NotImplementedError
+
+    def in_transaction(self, connection: Any) -> bool:
+        return connection.in_transaction
+
+    def is_connected(self, connection: Any) -> bool:
+        raise NotImplementedError
+
+    def server_info(self, connection: Any) -> str:
+        """ :return: Name and version of the server, changing when the server is upgraded. """
+        raise NotImplementedError
+
+    # Dialect
+
+    def table(self, db_name: str, table_name: str) -> str:
+        """ :return: The name statements refer to the table by. """
+        return f"{db_name}.{table_name}"
+
+    def update_table(self, table: str) -> str:
+        """ :return: Start of an UPDATE of the table, aliased T0. """
+        return f"UPDATE {table} AS T0"
+
+    def delete_table(self, table: str) -> str:
+        """ :return: Start of a DELETE from the table, aliased T0. """
+        raise NotImplementedError
+
+    def sort_key(self, value: Any) -> Any:
+        """ :return: The key ordering the column value in Python the way ORDER BY does, such as when merging the rows of shards. """
+        return value
+
+    def auto_increment_increment(self, connection: 'DatabaseConnection') -> int:
+        """ :return: The spacing between consecutive primary keys inserted by a single statement. """
+        return 1
+
+    def first_insert_id(self, cursor: Any, rows: int) -> int:
+        """ :return: Primary key of the first row inserted by the statement of the cursor. """
+        raise NotImplementedError
+
+    # Introspection and DDL
+
+    def create_database(self, cursor: Any, db_name: str) -> None:
+        """ Creates the database unless it exists, and makes it the current database of the connection. """
+        raise NotImplementedError
+
+    def use_database(self, cursor: Any, db_name: str) -> None:
+        raise NotImplementedError
+
+    def drop_database(self, cursor: Any, db_name: str) -> None:
+        raise NotImplementedError
+
+    def table_names(self, cursor: Any, db_name: str) -> set[str]:
+        raise NotImplementedError
+
+    def foreign_keys(self, cursor: Any, db_name: str) -> Iterable[tuple[str, str, str, str]]:
+        """ :return: (table, column, referenced table, referenced column) of every foreign key in the database. """
+        raise NotImplementedError
+
+    def indexes(self, cursor: Any, db_name: str, table_name: str) -> dict[tuple[str, ...], bool]:
+        """ :return: Maps the columns of every index of the table, primary key included, to whether it is unique. """
+        raise NotImplementedError
+
+    def create_table(self, table_name: str, pk_column: str, columns: Iterable[str], constraints: Iterable[str]) -> str:
+        """
+        :param columns: Definitions of the non-PK columns.
+        :param constraints: Table constraints following the columns, such as foreign keys.
+        :return: Statement creating the table in the current database, with an auto incrementing primary key.
+        """
+        raise NotImplementedError
+
+    def set_auto_increment(self, cursor: Any, db_name: str, table_name: str, value: int) -> None:
+        """ Makes the next row inserted into the new, empty, table take value as its primary key. """
+        raise NotImplementedError
+
+    def create_index(self, table_name: str, index_name: str, columns: Iterable[str], unique: bool) -> str:
+        return f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table_name} ({', '.join(columns)})"
+
+    def drop_index(self, db_name: str, table_name: str, index_name: str) -> str:
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__}>"
+
+
+class MySQLBackend(Backend):
+    """ MySQL and MariaDB, through mysql-connector. """
+
+    name = 'mysql'
+    DatabaseError = MySQLDatabaseError
+    max_placeholders = 65_535
+    max_identifier_length = 64
+    interleaved_results = False  # Prepared cursors stream their rows, which must be read before the next statement.
+
+    def execute(self, connection: 'DatabaseConnection', sql: str, params: tuple[Any, ...]) -> Any:
+        """
+        Executes the statement as a server-side prepared statement.
+        Every distinct statement keeps its own prepared cursor, such that the server only parses it once.
+        """
+        try:
+            sql, cursor = connection.prepared_statements.pop(sql)
+        except KeyError:
+            if len(connection.prepared_statements) >= MAX_PREPARED_STATEMENTS:
+                _, (_, evicted) = connection.prepared_statements.popitem(last=False)
+                evicted.close()  # Deallocates the statement on the server.
+            cursor = connection.connection.cursor(prepared=True)
+
+        # The cursor only skips preparing again when passed the same string object as last time.
+        connection.prepared_statements[sql] = sql, cursor
+        cursor.execute(sql, params)
+        return cursor
+
+    def close(self, connection: 'DatabaseConnection') -> None:
+        for _, cursor in connection.prepared_statements.values():
+            cursor.close()
+        connection.prepared_statements.clear()
+        super().close(connection)
+
+    def consume_results(self, connection: Any) -> None:
+        connection.consume_results()
+
+    def begin(self, connection: Any) -> None:
+        connection.start_transaction()
+
+    def is_connected(self, connection: Any) -> bool:
+        return connection.is_connected()  # Pings the server.
+
+    def server_info(self, connection: Any) -> str:
+        return f"{self.name} {connection.get_server_info()}"
+
+    def delete_table(self, table: str) -> str:
+        return f"DELETE T0 FROM {table} AS T0"
+
+    def sort_key(self, value: Any) -> Any:
+        """
+        Strings are ordered by the default collations of MySQL, which ignore case and accents (utf8mb4_0900_ai_ci);
+        approximated by their case folded characters without accents.
+        """
+        if isinstance(value, str):
+            return ''.join(char for char in normalize('NFKD', value) if not combining(char)).casefold()
+        return value
+
+    def auto_increment_increment(self, connection: 'DatabaseConnection') -> int:
+        # Consecutive AUTO_INCREMENT values may be spaced out, such as in multi-primary setups.
+        connection.cursor.execute("SELECT @@auto_increment_increment")
+        return connection.cursor.fetchall()[0][0]
+
+    def first_insert_id(self, cursor: Any, rows: int) -> int:
+        return cursor.lastrowid  # MySQL reports the id of the first row inserted by the statement.
+
+    def create_database(self, cursor: Any, db_name: str) -> None:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
+        cursor.execute(f"USE {db_name}")
+
+    def use_database(self, cursor: Any, db_name: str) -> None:
+        cursor.execute(f"USE {db_name}")
+
+    def drop_database(self, cursor: Any, db_name: str) -> None:
+        cursor.execute(f"DROP DATABASE IF EXISTS {db_name}")
+
+    def table_names(self, cursor: Any, db_name: str) -> set[str]:
+        cursor.execute(f"SHOW FULL TABLES FROM {db_name} WHERE Table_type = 'BASE TABLE'")
+        return {table_tuple[0] for table_tuple in cursor}
+
+    def foreign_keys(self, cursor: Any, db_name: str) -> Iterable[tuple[str, str, str, str]]:
+        cursor.execute(f"""
+            SELECT
+                TABLE_NAME,
+                COLUMN_NAME,
+                REFERENCED_TABLE_NAME,
+                REFERENCED_COLUMN_NAME
+            FROM
+                INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+            WHERE
+                REFERENCED_TABLE_SCHEMA = '{db_name}'
+        """)
+        return cursor.fetchall()
+
+    def indexes(self, cursor: Any, db_name: str, table_name: str) -> dict[tuple[str, ...], bool]:
+        cursor.execute(f"SHOW INDEX FROM {db_name}.{table_name}")
+        columns: dict[str, list[tuple[int, str]]] = {}
+        unique_names = set()
+        for row in cursor:  # Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+            columns.setdefault(row[2], []).append((row[3], row[4]))
+            if not row[1]:
+                unique_names.add(row[2])
+        return {tuple(column for _, column in sorted(index_columns)): name in unique_names for name, index_columns in columns.items()}
+
+    def create_table(self, table_name: str, pk_column: str, columns: Iterable[str], constraints: Iterable[str]) -> str:
+        definitions = (f"{pk_column} int NOT NULL AUTO_INCREMENT", *columns, f"PRIMARY KEY ({pk_column})", *constraints)
+        return f"CREATE TABLE {table_name} ({', '.join(definitions)});"
+
+    def set_auto_increment(self, cursor: Any, db_name: str, table_name: str, value: int) -> None:
+        cursor.execute(f"ALTER TABLE {db_name}.{table_name} AUTO_INCREMENT = {int(value)}")
+
+    def drop_index(self, db_name: str, table_name: str, index_name: str) -> str:
+        return f"DROP INDEX {index_name} ON {db_name}.{table_name}"
+
+
+class SQLiteBackend(Backend):
+    """ In-process SQLite databases, through the sqlite3 module of the standard library. """
+
+    name = 'sqlite'
+    DatabaseError = sqlite3.DatabaseError
+    # The default SQLITE_MAX_VARIABLE_NUMBER, which was raised in SQLite 3.32.0
+    max_placeholders = 32_766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    max_identifier_length = 128  # SQLite has no such limit, but keeps generated index names readable.
+    interleaved_results = True
+
+    def execute(self, connection: 'DatabaseConnection', sql: str, params: tuple[Any, ...]) -> Any:
+        # sqlite3 caches the compiled statements itself. Every statement gets its own cursor, such that streaming
+        # the result of one statement isn't cut short by the next.
+        return connection.connection.execute(sql.replace('%s', '?'), params)
+
+    def begin(self, connection: Any) -> None:
+        if not connection.in_transaction:
+            connection.execute("BEGIN")
+
+    def is_connected(self, connection: Any) -> bool:
+        try:
+            connection.execute("SELECT 1")
+        except sqlite3.ProgrammingError:  # Closed
+            return False
+        return True
+
+    def server_info(self, connection: Any) -> str:
+        return f"{self.name} {sqlite3.sqlite_version}"
+
+    def table(self, db_name: str, table_name: str) -> str:
+        return table_name  # The database is the file the connection was opened with.
+
+    def delete_table(self, table: str) -> str:
+        return f"DELETE FROM {table} AS T0"
+
+    def first_insert_id(self, cursor: Any, rows: int) -> int:
+        # SQLite reports the id of the last row, writers are serialized such that the ids of the statement are consecutive.
+        return cursor.lastrowid - rows + 1
+
+    def create_database(self, cursor: Any, db_name: str) -> None:
+        pass  # Every file is a database of its own.
+
+    def use_database(self, cursor: Any, db_name: str) -> None:
+        pass
+
+    def drop_database(self, cursor: Any, db_name: str) -> None:
+        """ Drops every table, leaving the file empty. """
+        foreign_keys = cursor.execute("PRAGMA foreign_keys").fetchone()[0]
+        cursor.execute("PRAGMA foreign_keys = OFF")  # Lets the tables be dropped in any order.
+        for table_name in self.table_names(cursor, db_name):
+            cursor.execute(f"DROP TABLE {table_name}")
+        cursor.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+
+    def table_names(self, cursor: Any, db_name: str) -> set[str]:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        return {table_tuple[0] for table_tuple in cursor.fetchall()}
+
+    def foreign_keys(self, cursor: Any, db_name: str) -> Iterable[tuple[str, str, str, str]]:
+        relationships = []
+        for table_name in self.table_names(cursor, db_name):
+            cursor.execute(f"PRAGMA foreign_key_list({table_name})")
+            for row in cursor.fetchall():  # id, seq, table, from, to, ...
+                relationships.append((table_name, row[3], row[2], row[4]))
+        return relationships
+
+    def indexes(self, cursor: Any, db_name: str, table_name: str) -> dict[tuple[str, ...], bool]:
+        cursor.execute(f"PRAGMA index_list({table_name})")
+        indexes = {}
+        for row in cursor.fetchall():  # seq, name, unique, origin, partial
+            cursor.execute(f"PRAGMA index_info({row[1]})")
+            indexes[tuple(column for _, _, column in sorted(cursor.fetchall()))] = bool(row[2])
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        indexes.update({(row[1],): True for row in cursor.fetchall() if row[5]})  # The rowid primary key has no index.
+        return indexes
+
+    def create_table(self, table_name: str, pk_column: str, columns: Iterable[str], constraints: Iterable[str]) -> str:
+        definitions = (f"{pk_column} INTEGER PRIMARY KEY AUTOINCREMENT", *columns, *constraints)
+        return f"CREATE TABLE {table_name} ({', '.join(definitions)});"
+
+    def set_auto_increment(self, cursor: Any, db_name: str, table_name: str, value: int) -> None:
+        # AUTOINCREMENT continues from the largest id handed out, as kept in sqlite_sequence.
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table_name, int(value) - 1))
+        cursor.connection.commit()
+
+    def drop_index(self, db_name: str, table_name: str, index_name: str) -> str:
+        return f"DROP INDEX {index_name}"
+
+
+MYSQL = MySQLBackend()
+SQLITE = SQLiteBackend()
+
+
+def backend_for(connection: Any) -> Backend:
+    """ :return: The backend of a connection opened by a database driver. """
+    return SQLITE if isinstance(connection, sqlite3.Connection) else MYSQL
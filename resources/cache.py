@@ -0,0 +1,322 @@
+"""
+Optional cache of query results, which QuerySet consults before querying the database.
+Results are cached as the selected rows, keyed by the compiled statement and its parameters,
+and are dropped when their tables are written through the ORM; or when their time to live runs out.
+
+    set_cache(QueryCache(MemoryCache(max_entries=10_000), ttl={NotSQLGroup: 60}))
+
+Only models given a time to live are cached. Rows changed without going through the ORM,
+such as by other applications, are only noticed once their entries expire.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run cache.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run cache.py instead of app.py. This, sadly, will not work :(")
+
+import sqlite3
+from sys import getsizeof
+from hashlib import sha1
+from threading import Lock, RLock
+from collections import OrderedDict
+from time import monotonic, time
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from typing import Any, Callable, Hashable, NamedTuple, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from resources.orm import DBModel
+
+Rows = list[tuple[Any, ...]]
+Key = tuple[str, tuple[Any, ...]]  # The statement and its parameters.
+
+
+class CacheStats(NamedTuple):
+    """ Snapshot of the usage of a QueryCache. """
+    hits: int
+    misses: int  # Lookups of cached models, which had to query the database.
+    invalidations: int  # Writes which dropped the entries of their table.
+    entries: int  # Entries currently held by the backend.
+    evictions: int  # Entries dropped by the backend to stay within its bounds, not counting expired entries.
+
+
+class CacheBackend:
+    """
+    Storage of the cached rows. Every table has a version, which is changed when the table is invalidated;
+    entries are only stored when the versions of their tables are unchanged since the query was started,
+    such that a result read before a write is not cached after the write invalidated the table.
+    """
+
+    evictions: int = 0
+
+    def get(self, key: Key) -> Rows | None:
+        """ :return: The cached rows, or None when the key isn't cached or has expired. """
+        raise NotImplementedError
+
+    def set(self, key: Key, rows: Rows, tables: tuple[str, ...], ttl: float, versions: Hashable) -> None:
+        """
+        :param tables: Tables read by the statement, invalidating any of them drops the entry.
+        :param ttl: Seconds until the entry expires.
+        :param versions: Returned by versions() before the query was started.
+        """
+        raise NotImplementedError
+
+    def versions(self, tables: tuple[str, ...]) -> Hashable:
+        raise NotImplementedError
+
+    def invalidate(self, table: str) -> None:
+        """ Drops every entry reading the table. """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """ Cache within the current process, evicting the least recently used entries when either bound is exceeded. """
+
+    max_entries: int
+    max_bytes: int | None
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None) -> None:
+        """
+        :param max_entries: Maximum number of cached results.
+        :param max_bytes: Maximum (approximate) size of the cached rows, unbounded by default.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Maps keys to their rows, tables, expiry and size. Ordered from least to most recently used.
+        self._entries: OrderedDict[Key, tuple[Rows, tuple[str, ...], float, int]] = OrderedDict()
+        self._tables: dict[str, set[Key]] = {}  # Keys of the entries reading each table.
+        self._versions: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = Lock()
+        super().__init__()
+
+    @staticmethod
+    def _sizeof(rows: Rows) -> int:
+        return getsizeof(rows) + sum(getsizeof(row) + sum(getsizeof(value) for value in row) for row in rows)
+
+    def _remove(self, key: Key) -> None:
+        _, tables, _, size = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._tables[table]
+            keys.discard(key)
+            if not keys:
+                del self._tables[table]
+
+    def get(self, key: Key) -> Rows | None:
+        with self._lock:
+            try:
+                rows, _, expires, _ = self._entries[key]
+            except KeyError:
+                return None
+            if expires <= monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return rows
+
+    def set(self, key: Key, rows: Rows, tables: tuple[str, ...], ttl: float, versions: Hashable) -> None:
+        size = self._sizeof(rows) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # Would evict everything else, and still not fit.
+
+        with self._lock:
+            if versions != self.versions(tables):
+                return  # Invalidated while the query ran.
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = rows, tables, monotonic() + ttl, size
+            self._bytes += size
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def versions(self, tables: tuple[str, ...]) -> Hashable:
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def invalidate(self, table: str) -> None:
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+            for key in tuple(self._tables.get(table, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tables.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FileCache(CacheBackend):
+    """
+    Cache stored in an SQLite file, which may be shared by several worker processes on the same machine.
+    Writes by any of the processes invalidate the entries of every process.
+    """
+
+    max_entries: int
+
+    def __init__(self, path: str, max_entries: int = 10_000, timeout: float = 5.0) -> None:
+        """
+        :param path: File holding the cache, created if it doesn't exist.
+        :param max_entries: Maximum number of cached results, the least recently used are evicted when exceeded.
+        :param timeout: Seconds to wait for other processes writing the file.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+
+        self.max_entries = max_entries
+        self._lock = RLock()
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")  # Readers don't block the writer, nor the other way around.
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, rows BLOB, expires REAL, used REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entry_tables (key BLOB, table_name TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entry_tables_table_name ON entry_tables (table_name)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS versions (table_name TEXT PRIMARY KEY, version INTEGER)")
+        super().__init__()
+
+    @staticmethod
+    def _digest(key: Key) -> bytes:
+        return sha1(dumps(key, HIGHEST_PROTOCOL)).digest()
+
+    def get(self, key: Key) -> Rows | None:
+        digest = self._digest(key)
+        with self._lock:
+            found = self._db.execute("SELECT rows, expires FROM entries WHERE key = ?", (digest,)).fetchone()
+            if found is None:
+                return None
+            if found[1] <= time():
+                self._db.execute("DELETE FROM entries WHERE key = ?", (digest,))
+                self._db.execute("DELETE FROM entry_tables WHERE key = ?", (digest,))
+                return None
+            self._db.execute("UPDATE entries SET used = ? WHERE key = ?", (time(), digest))
+        return loads(found[0])
+
+    def set(self, key: Key, rows: Rows, tables: tuple[str, ...], ttl: float, versions: Hashable) -> None:
+        digest, data, now = self._digest(key), dumps(rows, HIGHEST_PROTOCOL), time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")  # Other processes can't invalidate the tables before we commit.
+            try:
+                if versions != self.versions(tables):
+                    return  # Invalidated while the query ran.
+                self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (digest, data, now + ttl, now))
+                self._db.execute("DELETE FROM entry_tables WHERE key = ?", (digest,))
+                self._db.executemany("INSERT INTO entry_tables VALUES (?, ?)", ((digest, table) for table in tables))
+
+                excess = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    evicted = self._db.execute("SELECT key FROM entries ORDER BY used LIMIT ?", (excess,)).fetchall()
+                    self._db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+                    self._db.executemany("DELETE FROM entry_tables WHERE key = ?", evicted)
+                    self.evictions += len(evicted)
+            finally:
+                self._db.execute("COMMIT")
+
+    def versions(self, tables: tuple[str, ...]) -> Hashable:
+        with self._lock:
+            found = dict(self._db.execute(f"SELECT table_name, version FROM versions WHERE table_name IN ({', '.join('?' for _ in tables)})", tables))
+        return tuple(found.get(table, 0) for table in tables)
+
+    def invalidate(self, table: str) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("INSERT INTO versions VALUES (?, 1) ON CONFLICT (table_name) DO UPDATE SET version = version + 1", (table,))
+                keys = self._db.execute("SELECT key FROM entry_tables WHERE table_name = ?", (table,)).fetchall()
+                self._db.executemany("DELETE FROM entries WHERE key = ?", keys)
+                self._db.executemany("DELETE FROM entry_tables WHERE key = ?", keys)
+            finally:
+                self._db.execute("COMMIT")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM entry_tables")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class QueryCache:
+    """ Caches the results of the models given a time to live, in the provided backend. """
+
+    backend: CacheBackend
+    ttl: dict[Type['DBModel'], float]
+    default_ttl: float | None
+
+    def __init__(self, backend: CacheBackend = None, ttl: dict[Type['DBModel'], float] = None, default_ttl: float = None) -> None:
+        """
+        :param backend: Storage of the cached rows, a MemoryCache by default.
+        :param ttl: Seconds to cache the results of each model, counting from when they were queried.
+        :param default_ttl: Seconds to cache the results of models not in ttl, which are not cached by default.
+        """
+        self.backend = MemoryCache() if backend is None else backend
+        self.ttl = dict(ttl or {})
+        self.default_ttl = default_ttl
+        self._hits = self._misses = self._invalidations = 0
+        super().__init__()
+
+    def fetch(self, model: Type['DBModel'], tables: tuple[str, ...], sql: str, params: tuple[Any, ...],
+              query: Callable[[], Rows]) -> Rows:
+        """
+        :param tables: Tables read by the statement, the first being the model's own.
+        :param query: Queries the database, when the rows aren't cached.
+        :return: The rows selected by the statement.
+        """
+        ttl = self.ttl.get(model, self.default_ttl)
+        if ttl is None:
+            return query()
+
+        key = sql, params
+        rows = self.backend.get(key)
+        if rows is not None:
+            self._hits += 1
+            return rows
+
+        self._misses += 1
+        versions = self.backend.versions(tables)
+        rows = query()
+        self.backend.set(key, rows, tables, ttl, versions)
+        return rows
+
+    def invalidate(self, table: str) -> None:
+        """ Drops the cached results reading the table, called by the ORM whenever it writes the table. """
+        self._invalidations += 1
+        self.backend.invalidate(table)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(self._hits, self._misses, self._invalidations, len(self.backend), self.backend.evictions)
+
+    def reset_stats(self) -> None:
+        self._hits = self._misses = self._invalidations = 0
+        self.backend.evictions = 0
+
+
+_cache: QueryCache | None = None
+
+
+def set_cache(cache: QueryCache | None) -> None:
+    """ Caches the results of every QuerySet in the provided cache, or stops caching when passed None. """
+    global _cache
+    _cache = cache
+
+
+def get_cache() -> QueryCache | None:
+    return _cache
@@ -0,0 +1,249 @@
+"""
+Compiles parameterized SQL statements for models.
+Statements are cached per model and field set, such that hot paths reuse the very same string,
+and with it the server-side prepared statement of DatabaseConnection.execute().
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run compiler.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run compiler.py instead of app.py. This, sadly, will not work :(")
+
+from threading import Lock
+from typing import Any, Callable, Type
+from resources import orm
+from resources.init import foreignkey_relationships
+
+# Statements cached per model, the oldest is dropped when exceeded. Bounds the cache when conditions vary in shape.
+MAX_CACHED_STATEMENTS = 1024
+
+_statements_lock = Lock()  # Dropping and adding statements, by the threads sharing a model.
+
+# Passed to LIMIT for slices without an end, as OFFSET can't be used without a LIMIT.
+NO_LIMIT = 2 ** 63 - 1
+
+# Supported lookups for QuerySet.filter() and Q(), such as name__in=('a', 'b')
+LOOKUPS = {
+    'exact': '=',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+    'in': 'IN',
+    'isnull': 'IS NULL',
+}
+
+
+def _cached(model: Type['orm.DBModel'], key: tuple, build: Callable[[], str]) -> str:
+    """ :return: The statement cached on the model's meta under key, building and caching it first if needed. """
+    statements = model.meta.statements
+    if (sql := statements.get(key, None)) is not None:
+        return sql
+    sql = build()
+    with _statements_lock:
+        while len(statements) >= MAX_CACHED_STATEMENTS:
+            del statements[next(iter(statements))]
+        return statements.setdefault(key, sql)
+
+
+def resolve_column(model: Type['orm.DBModel'], name: str) -> str:
+    """ :return: The column of the model referred to by name; either 'pk', a field name or the name of a column. """
+    if name == 'pk':
+        return model.meta.pk_column
+    fieldtype = model.meta.fields.get(name, None)
+    if isinstance(fieldtype, orm.LazygetterWrapper):
+        return fieldtype.model.meta.pk_column
+    if name in model.meta.columns:
+        return name
+    raise AttributeError(f"{name} is not a valid field for {model}")
+
+
+def resolve_lookup(model: Type['orm.DBModel'], key: str) -> tuple[str, str]:
+    """ :return: The column and lookup of a keyword for filter(), such as ('name', 'in') for name__in """
+    name, _, lookup = key.rpartition('__')
+    if lookup not in LOOKUPS:
+        name, lookup = key, 'exact'
+    return resolve_column(model, name), lookup
+
+
+def compile_lookup(model: Type['orm.DBModel'], key: str, value: Any) -> tuple[str, tuple[Any, ...]]:
+    """ :return: The condition for a single keyword of filter(), such as name__in=('a', 'b'), and its parameters. """
+    column, lookup = resolve_lookup(model, key)
+    column = f"T0.{column}"
+
+    if isinstance(value, orm.DBModel):  # Related instances are compared by their primary key.
+        value = value.pk
+
+    if lookup == 'isnull':
+        return f"{column} IS {'' if value else 'NOT '}NULL", ()
+    if lookup == 'exact' and value is None:  # NULL is never equal to anything.
+        return f"{column} IS NULL", ()
+    if lookup == 'in':
+        values = tuple(item.pk if isinstance(item, orm.DBModel) else item for item in value)
+        if not values:
+            return "1 = 0", ()  # IN () is a syntax error, while matching nothing is the intent.
+        return f"{column} IN ({', '.join('%s' for _ in values)})", values
+    return f"{column} {LOOKUPS[lookup]} %s", (value,)
+
+
+def compile_where(model: Type['orm.DBModel'], condition: 'orm.Q') -> tuple[str, tuple[Any, ...]]:
+    """ :return: The condition of the Q() tree, with %s placeholders for its parameters. """
+    parts, params = [], []
+    for child in condition.children:
+        if isinstance(child, orm.Q):
+            child_sql, child_params = compile_where(model, child)
+            if len(child.children) > 1 and not child.negated:  # Negated conditions are already wrapped by NOT (...)
+                child_sql = f"({child_sql})"
+        else:
+            child_sql, child_params = compile_lookup(model, *child)
+        parts.append(child_sql)
+        params += child_params
+
+    sql = f" {condition.connector} ".join(parts)
+    return (f"NOT ({sql})" if condition.negated else sql), tuple(params)
+
+
+def compile_order_by(model: Type['orm.DBModel'], fields: tuple[str, ...]) -> str:
+    """ :param fields: Field names to order by, descending when prefixed with '-' """
+    return ', '.join(f"T0.{resolve_column(model, field.lstrip('-'))}{' DESC' if field.startswith('-') else ''}" for field in fields)
+
+
+def compile_seek(model: Type['orm.DBModel'], field: str, descending: bool = False) -> str:
+    """
+    Condition of keyset pagination, matching the rows ordered after (or before, when descending) a row by the field and primary key.
+    The parameters hold the value of the field and primary key of that row; only the primary key, when the field is the primary key.
+    """
+    column, pk_column = resolve_column(model, field), model.meta.pk_column
+    operator = '<' if descending else '>'
+    if column == pk_column:
+        return f"T0.{pk_column} {operator} %s"
+    return f"(T0.{column}, T0.{pk_column}) {operator} (%s, %s)"
+
+
+def table(model: Type['orm.DBModel']) -> str:
+    """ :return: The name statements refer to the table of the model by, qualified by its database where supported. """
+    return model.meta.connection.backend.table(model.meta.database_name, model.meta.table_name)
+
+
+def _from_where(model: Type['orm.DBModel'], where: str = None) -> str:
+    sql = f"FROM {table(model)} T0"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+
+def compile_select(model: Type['orm.DBModel'], select_related: tuple[str, ...] = (), where: str = None,
+                   order_by: str = None, columns: tuple[str, ...] = None, sliced: bool = False) -> str:
+    """
+    The queried table is always aliased T0, joined tables are aliased T1, T2, ... in the order they were requested.
+
+    :param select_related: Foreign key fields to LEFT JOIN, their columns follow the columns of the model itself.
+    :param where: Condition with %s placeholders, referring to the columns through their alias.
+    :param order_by: ORDER BY clause, as compiled by compile_order_by()
+    :param columns: Only select these columns of the model, rather than all of them.
+    :param sliced: Select a slice of the rows, whose LIMIT and OFFSET follow the other parameters. Use NO_LIMIT for slices without an end.
+    """
+    def build() -> str:
+        backend = model.meta.connection.backend
+        current_table = model.meta.table_name
+
+        selected = [f"T0.{column}" for column in (model.meta.columns if columns is None else columns)]
+        joins = []
+        for alias, field in enumerate(select_related, start=1):
+            fk_model: Type[orm.DBModel] = getattr(model, field).model
+            # Tables created without the foreign key constraint may still be joined on the conventional column names.
+            ref_table, ref_column = foreignkey_relationships.get(current_table, {}).get(
+                fk_model.meta.pk_column, (fk_model.meta.table_name, fk_model.meta.pk_column))
+            selected += (f"T{alias}.{column}" for column in fk_model.meta.columns)
+            joins.append(f"LEFT JOIN {backend.table(model.meta.database_name, ref_table)} T{alias} ON T0.{fk_model.meta.pk_column} = T{alias}.{ref_column}")
+
+        sql = f"SELECT {', '.join(selected)} FROM {table(model)} T0"
+        if joins:
+            sql += f" {' '.join(joins)}"
+        if where:
+            sql += f" WHERE {where}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if sliced:
+            sql += " LIMIT %s OFFSET %s"
+        return sql
+
+    return _cached(model, ('select', select_related, where, order_by, columns, sliced), build)
+
+
+def compile_count(model: Type['orm.DBModel'], where: str = None) -> str:
+    return _cached(model, ('count', where), lambda: f"SELECT COUNT(*) {_from_where(model, where)}")
+
+
+def compile_exists(model: Type['orm.DBModel'], where: str = None) -> str:
+    return _cached(model, ('exists', where), lambda: f"SELECT 1 {_from_where(model, where)} LIMIT 1")
+
+
+def compile_insert(model: Type['orm.DBModel'], rows: int = 1) -> str:
+    """ :param rows: Number of rows inserted by the statement, each taking a value for every non-PK column. """
+    def build() -> str:
+        columns = model.meta.columns[1:]
+        placeholders = f"({', '.join('%s' for _ in columns)})"
+        return (f"INSERT INTO {table(model)}"
+                f"({', '.join(columns)}) VALUES {', '.join(placeholders for _ in range(rows))}")
+
+    return _cached(model, ('insert', rows), build)
+
+
+def compile_update(model: Type['orm.DBModel'], fields: tuple[str, ...]) -> str:
+    """ :param fields: Names of the fields to update, followed by the primary key in the parameters. """
+    def build() -> str:
+        field_columns = dict(zip(model.meta.fields.keys(), model.meta.columns[1:]))
+        assignments = ', '.join(f"{field_columns[field]} = %s" for field in fields)
+        return f"UPDATE {table(model)} SET {assignments} WHERE {model.meta.pk_column} = %s"
+
+    return _cached(model, ('update', fields), build)
+
+
+def compile_delete(model: Type['orm.DBModel']) -> str:
+    return _cached(model, ('delete',), lambda: f"DELETE FROM {table(model)} WHERE {model.meta.pk_column} = %s")
+
+
+def compile_update_where(model: Type['orm.DBModel'], columns: tuple[str, ...], where: str = None) -> str:
+    """
+    :param columns: Columns to update, their values come first in the parameters.
+    :param where: Condition as compiled by compile_where(), every row is updated without one.
+    """
+    def build() -> str:
+        assignments = ', '.join(f"{column} = %s" for column in columns)
+        sql = f"{model.meta.connection.backend.update_table(table(model))} SET {assignments}"
+        if where:
+            sql += f" WHERE {where}"
+        return sql
+
+    return _cached(model, ('update_where', columns, where), build)
+
+
+def compile_delete_where(model: Type['orm.DBModel'], where: str = None) -> str:
+    """ :param where: Condition as compiled by compile_where(), every row is deleted without one. """
+    def build() -> str:
+        sql = model.meta.connection.backend.delete_table(table(model))
+        if where:
+            sql += f" WHERE {where}"
+        return sql
+
+    return _cached(model, ('delete_where', where), build)
+
+
+def compile_bulk_update(model: Type['orm.DBModel'], fields: tuple[str, ...], rows: int) -> str:
+    """
+    Updates the fields of several rows in one statement, each row taking its own values through CASE.
+    The parameters hold a (PK, value) pair per row for every field in turn, followed by the PK of every row.
+
+    :param fields: Names of the fields to update.
+    :param rows: Number of rows updated by the statement.
+    """
+    def build() -> str:
+        pk_column = model.meta.pk_column
+        field_columns = dict(zip(model.meta.fields.keys(), model.meta.columns[1:]))
+        cases = ' '.join('WHEN %s THEN %s' for _ in range(rows))
+        assignments = ', '.join(f"{field_columns[field]} = CASE {pk_column} {cases} END" for field in fields)
+        return (f"UPDATE {table(model)} SET {assignments} "
+                f"WHERE {pk_column} IN ({', '.join('%s' for _ in range(rows))})")
+
+    return _cached(model, ('bulk_update', fields, rows), build)
+
@@ -1,3 +1,10 @@
 class AbstractInstantiationError(Exception):
     """ Applicable when illegally trying to instantiate an abstract class. """
 
+
+class PoolTimeoutError(Exception):
+    """ Applicable when no connection could be checked out of a ConnectionPool within its timeout. """
+
+
+class NPlusOneWarning(UserWarning):
+    """ Applicable when the same foreign key is queried row by row, rather than through select_related() or prefetch_related(). """
@@ -1,21 +1,27 @@
 """ Contains functions for initializing either the ORM or database. """
 
-from typing import Any, Type
+import os
+import json
+from time import time
+from hashlib import sha256
+from threading import Thread
+from typing import Any, Type, TYPE_CHECKING
 
-from mysql.connector import ProgrammingError, DatabaseError
-
-from resources.utils import ConnectionSingleton
+from resources.utils import DatabaseConnection, ConnectionPool
 
 if __name__ == '__main__':
     # Gently remind the user to not run enums.py themselves
     raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run init.py instead of app.py. This, sadly, will not work :(")
 
 
-from .modelfields import StringField
+from .modelfields import StringField, Index
 from mysql.connector.cursor import CursorBase
+from resources.backends import Backend
 # from .orm import DBModel, ModelField, Models, ModelMeta
 from resources import orm
-from itertools import chain
+
+if TYPE_CHECKING:
+    from resources.sharding import Sharding
 
 # TODO Kevin: Decide what to make of this dictionary
 foreignkey_relationships: dict[str, dict[str, tuple[str, str]]] = {}
@@ -32,7 +38,7 @@ def _get_columns(cursor: CursorBase, db_name: str, table_name: str):
     return columndata, next(col[0] for col in columndata if col[3] == 'PRI')
 
 
-def _add_metadata(model: Type['orm.DBModel'], db_name: str, connection: ConnectionSingleton):
+def _add_metadata(model: Type['orm.DBModel'], db_name: str, connection: DatabaseConnection | ConnectionPool):
     # columns, pk_column = _get_columns(cursor, db_name, model.__name__)  # Get the needed column data for the current model.
 
     # We add Meta to the model after declaration, such that it may refer back to its model.
@@ -47,81 +53,151 @@ def _add_metadata(model: Type['orm.DBModel'], db_name: str, connection: Connecti
     table_name = model.__name__
 
     # TODO Kevin: Hardcoded PK field
-    model.meta = orm.ModelMeta(table_name + 'ID', table_name, db_name, fields={
-        field: value for field, value in (model.__annotations__ | model.__dict__).items() if not field.startswith('__') and not isinstance(value, orm.ModelMeta)
-    }, connection=connection)
-
-
-def connect_orm(connection: ConnectionSingleton, db_name: str) -> set['orm.DBModel']:
+    model.meta = orm.ModelMeta(table_name + 'ID', table_name, db_name, fields=dict(model._declared_fields), connection=connection, statements={},
+                                indexes=model._indexes)
+
+
+def _introspect_foreignkeys(backend: Backend, cursor: CursorBase, db_name: str) -> dict[str, dict[str, tuple[str, str]]]:
+    """ :return: Every foreignkey relationship in the database; table -> column -> (referenced table, referenced column) """
+    relationships: dict[str, dict[str, tuple[str, str]]] = {}
+    for table, column, referenced_table, referenced_column in backend.foreign_keys(cursor, db_name):
+        relationships.setdefault(table, {})[column] = (referenced_table, referenced_column)
+    return relationships
+
+
+def _schema_fingerprint(db_name: str, server_info: str) -> str:
+    """ :return: Hash of the declared models and the server they are connected to, which the schema cache must match. """
+    models = sorted(
+        (model.meta.table_name, [(fieldname, fieldtype.model.meta.table_name if isinstance(fieldtype, orm.LazygetterWrapper) else repr(fieldtype))
+                                 for fieldname, fieldtype in model.meta.fields.items()])
+        for model in orm.Models.values()
+    )
+    return sha256(json.dumps([db_name, server_info, models]).encode()).hexdigest()
+
+
+def _read_schema_cache(path: str, fingerprint: str) -> tuple[dict[str, dict[str, tuple[str, str]]], float] | None:
+    """ :return: The cached foreignkey relationships and when they were introspected, unless missing or made for another schema. """
+    try:
+        with open(path) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('fingerprint') != fingerprint:
+        return None
+    return ({table: {column: tuple(referenced) for column, referenced in columns.items()}
+             for table, columns in cached['foreignkey_relationships'].items()}, cached['created'])
+
+
+def _write_schema_cache(path: str, fingerprint: str, relationships: dict[str, dict[str, tuple[str, str]]]) -> None:
+    # Write a temporary file first, such that concurrently starting processes never read half a file.
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as file:
+        json.dump({'fingerprint': fingerprint, 'created': time(), 'foreignkey_relationships': relationships}, file)
+    os.replace(temporary, path)
+
+
+def _set_foreignkey_relationships(relationships: dict[str, dict[str, tuple[str, str]]]) -> None:
+    """ Replaces the contents of foreignkey_relationships, which other modules hold a reference to. """
+    if relationships == foreignkey_relationships:
+        return
+    foreignkey_relationships.clear()
+    foreignkey_relationships.update(relationships)
+    for model in orm.Models.values():  # Joins are compiled from the relationships.
+        model.meta.statements.clear()
+
+
+def _refresh_schema_cache(connection: DatabaseConnection | ConnectionPool, db_name: str, path: str, fingerprint: str) -> None:
+    with connection.acquire() as acquired:
+        relationships = _introspect_foreignkeys(acquired.backend, acquired.cursor, db_name)
+    _set_foreignkey_relationships(relationships)
+    _write_schema_cache(path, fingerprint, relationships)
+
+
+def connect_orm(connection: DatabaseConnection | ConnectionPool, db_name: str, schema_cache: str = None,
+                schema_cache_max_age: float = 3600.0, shards: dict[Type['orm.DBModel'], 'Sharding'] = None) -> set['orm.DBModel']:
     """
     Connects to the desired database and initialises foreignkey relations between models.
 
-    :param cursor: Cursor to use when querying the database.
+    :param connection: Connection, or pool of connections, the models should use.
     :param db_name: Name of the database to connect to.
+    :param schema_cache: File to cache the introspected schema in, which skips the (slow) introspection on later starts.
+        The cache is only used while the declared models and server are unchanged.
+    :param schema_cache_max_age: Seconds after which a cached schema is refreshed; in a background thread,
+        while the cached schema is used in the meantime.
+    :param shards: Models whose rows are split over the shards of a resources.sharding strategy, rather than stored in db_name.
     :return: The populated Models set.
     """
+    shards = shards or {}
 
-    cursor = connection.cursor
-
-    if not cursor or not db_name:
-        raise SystemExit("A successful connection to the database must be established before the ORM may be initialized")
-
-    # cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-    cursor.execute(f"USE {db_name}")
-
-    for model in orm.Models.values():
-        _add_metadata(model, db_name, connection)
-
-    # Populate the global _foreignkey_relationships dictionary.
-    global foreignkey_relationships
-
-    # Get all foreignkey relationships in the database.
-    cursor.execute(f"""
-        SELECT
-            TABLE_NAME,
-            COLUMN_NAME,
-            CONSTRAINT_NAME,
-            REFERENCED_TABLE_NAME,
-            REFERENCED_COLUMN_NAME
-        FROM
-            INFORMATION_SCHEMA.KEY_COLUMN_USAGE
-        WHERE
-            REFERENCED_TABLE_SCHEMA = '{db_name}'
-    """)
-
-    for row in cursor:
-        if row[0] in foreignkey_relationships:
-            foreignkey_relationships[row[0]].update({row[1]: (row[3], row[4])})
-        else:
-            foreignkey_relationships[row[0]] = {row[1]: (row[3], row[4])}
+    with connection.acquire() as acquired:
+        cursor = acquired.cursor
+
+        if not cursor or not db_name:
+            raise SystemExit("A successful connection to the database must be established before the ORM may be initialized")
+
+        # acquired.backend.create_database(cursor, db_name)
+        acquired.backend.use_database(cursor, db_name)
+
+        for model in orm.Models.values():
+            _add_metadata(model, db_name, shards.get(model, connection))
+
+        # Populate the global foreignkey_relationships dictionary.
+        if schema_cache is None:
+            _set_foreignkey_relationships(_introspect_foreignkeys(acquired.backend, cursor, db_name))
+            return orm.Models
+
+        fingerprint = _schema_fingerprint(db_name, acquired.server_info())
+        cached = _read_schema_cache(schema_cache, fingerprint)
+        if cached is None:
+            relationships = _introspect_foreignkeys(acquired.backend, cursor, db_name)
+            _set_foreignkey_relationships(relationships)
+            _write_schema_cache(schema_cache, fingerprint, relationships)
+            return orm.Models
+
+    relationships, created = cached
+    _set_foreignkey_relationships(relationships)
+    if time() - created >= schema_cache_max_age:
+        Thread(target=_refresh_schema_cache, args=(connection, db_name, schema_cache, fingerprint),
+               name='MyQueryORM-schema', daemon=True).start()
 
     return orm.Models
 
 
-def create_tables(connection: ConnectionSingleton, db_name: str) -> None:
+def create_tables(connection: DatabaseConnection | ConnectionPool, db_name: str,
+                  shards: dict[Type['orm.DBModel'], 'Sharding'] = None) -> None:
     """
     Create tables from models in the database. Constitutes the initial migration.
 
-    :param cursor: Cursor to use when querying the database.
+    :param connection: Connection, or pool of connections, the models should use.
     :param db_name: Name of the database to connect to.
+    :param shards: Models whose tables are created in the database of every shard of a resources.sharding strategy instead.
+        Their tables have no foreign key constraints, and neither do the tables referring to them,
+        as the related rows may be stored on another shard or database.
     """
+    shards = shards or {}
 
-    cursor = connection.cursor
+    def _index_columns(model: Type[orm.DBModel], index: Index) -> tuple[str, ...]:
+        return tuple(model.meta.fields[field].model.meta.pk_column if isinstance(model.meta.fields[field], orm.LazygetterWrapper)
+                     else field for field in index.fields)
 
-    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-    cursor.execute(f"USE {db_name}")
-    cursor.execute("SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'")
-    table_names = {table_tuple[0] for table_tuple in cursor}
+    def _create_indexstring(backend: Backend, model: Type[orm.DBModel], index: Index) -> str:
+        columns = _index_columns(model, index)
+        name = index.name or f"{'ux' if index.unique else 'ix'}_{model.meta.table_name}_{'_'.join(columns)}"
+        if len(name) > backend.max_identifier_length:  # Keep shortened names unique by their hash.
+            name = f"{name[:backend.max_identifier_length - 9]}_{sha256(name.encode()).hexdigest()[:8]}"
+        return backend.create_index(model.meta.table_name, name, columns, index.unique)
 
-    for model in orm.Models.values():
-        _add_metadata(model, db_name, connection)
-
-    model_names = {model.meta.table_name for model in orm.Models.values()}
-
-    # Sanity check columns on existing tables.
-    for table in table_names.intersection(model_names):
+    def _add_missing_indexes(backend: Backend, cursor: CursorBase, model: Type[orm.DBModel]) -> None:
+        """ Adds the declared indexes missing from the existing table, compared by their columns rather than their names. """
         # TODO Kevin: Do sanity check here.
-        print(f"{db_name}.{table} already exists")
+        print(f"{db_name}.{model.meta.table_name} already exists")
+        existing_columns = backend.indexes(cursor, db_name, model.meta.table_name)
+
+        for index in model.meta.indexes:
+            columns = _index_columns(model, index)
+            if columns not in existing_columns or (index.unique and not existing_columns[columns]):
+                cursor.execute(_create_indexstring(backend, model, index))
+                print(f"Created index on {db_name}.{model.meta.table_name} ({', '.join(index.fields)})")
 
     def _create_typestring(fieldname: str, fieldtype: Any) -> str:
         if _isinstanceorsubclass(fieldtype, StringField):
@@ -133,32 +209,71 @@ def create_tables(connection: ConnectionSingleton, db_name: str) -> None:
         else:
             raise TypeError(f"Cannot create column for field of type {fieldtype}")
 
-    def _create_fkstring(fieldtype: orm.DBModel) -> str:
-        return f"FOREIGN KEY ({fieldtype.meta.pk_column}) REFERENCES {fieldtype.meta.table_name}({fieldtype.meta.pk_column})"
-
-    # Set of tables not already created.
-    newtables = {model for model in orm.Models.values() if model.meta.table_name not in table_names}
-
-    # Check for missing tables.
-    # Try repeatedly, in case we try creating a foreignkey to a table not yet created.
-    while (iter_set := newtables.copy()):  # No models == no work to do
-        startlen = len(newtables)
-        for model in iter_set:
-            try:  # to create this table
-                fieldstring = ', '.join(chain(
-                    # TODO Kevin: Hardcoded stuff here
-                    (f"{model.meta.pk_column} int NOT NULL AUTO_INCREMENT",),
-                    (_create_typestring(fieldname, fieldtype) for fieldname, fieldtype in
-                     model.meta.fields.items()),
-                    (f"PRIMARY KEY ({model.meta.pk_column})",),
-                    (_create_fkstring(fieldtype) for fieldname, fieldtype in model.meta.fields.items() if
-                     _isinstanceorsubclass(fieldtype, orm.DBModel)))
-                )
-
-                cursor.execute(f"CREATE TABLE {model.meta.table_name} ({fieldstring});")
-                newtables.remove(model)
-            except DatabaseError:  # Probably tried to create a foreignkey to a table not yet created.
-                continue
-
-        if len(newtables) == startlen:  # We can't create any tables.
-            break
+    def _create_fkstring(fieldtype: orm.LazygetterWrapper) -> str:
+        fk_model = fieldtype.model
+        return f"FOREIGN KEY ({fk_model.meta.pk_column}) REFERENCES {fk_model.meta.table_name}({fk_model.meta.pk_column})"
+
+    def _create_tablestring(backend: Backend, model: Type[orm.DBModel]) -> str:
+        # TODO Kevin: Hardcoded stuff here
+        return backend.create_table(
+            model.meta.table_name,
+            model.meta.pk_column,
+            (_create_typestring(fieldname, fieldtype) for fieldname, fieldtype in model.meta.fields.items()),
+            () if model in shards else
+            (_create_fkstring(fieldtype) for fieldname, fieldtype in model.meta.fields.items() if
+             _isinstanceorsubclass(fieldtype, orm.LazygetterWrapper) and fieldtype.model not in shards),
+        )
+
+    with connection.acquire() as acquired:
+        cursor = acquired.cursor
+        backend = acquired.backend
+
+        backend.create_database(cursor, db_name)
+        table_names = backend.table_names(cursor, db_name)
+
+        for model in orm.Models.values():
+            _add_metadata(model, db_name, shards.get(model, connection))
+
+        # Sanity check columns on existing tables.
+        for model in orm.Models.values():
+            if model.meta.table_name in table_names and model not in shards:
+                _add_missing_indexes(backend, cursor, model)
+
+        # Set of tables not already created.
+        newtables = {model for model in orm.Models.values() if model.meta.table_name not in table_names and model not in shards}
+
+        # Check for missing tables.
+        # Try repeatedly, in case we try creating a foreignkey to a table not yet created.
+        while (iter_set := newtables.copy()):  # No models == no work to do
+            startlen = len(newtables)
+            for model in iter_set:
+                try:  # to create this table
+                    cursor.execute(_create_tablestring(backend, model))
+                    newtables.remove(model)
+                except backend.DatabaseError:  # Probably tried to create a foreignkey to a table not yet created.
+                    continue
+
+            if len(newtables) == startlen:  # We can't create any tables.
+                break
+
+        for model in orm.Models.values():
+            if model.meta.table_name not in table_names and model not in newtables and model not in shards:  # Created above.
+                for index in model.meta.indexes:
+                    cursor.execute(_create_indexstring(backend, model, index))
+
+    # Every shard holds a table of its own, handing out the primary keys of the shard.
+    for model, sharding in shards.items():
+        for position, shard in enumerate(sharding.shards):
+            with shard.acquire() as acquired:
+                cursor = acquired.cursor
+                backend = acquired.backend
+
+                backend.create_database(cursor, db_name)
+                if model.meta.table_name in backend.table_names(cursor, db_name):
+                    _add_missing_indexes(backend, cursor, model)
+                    continue
+
+                cursor.execute(_create_tablestring(backend, model))
+                backend.set_auto_increment(cursor, db_name, model.meta.table_name, sharding.first_id(position))
+                for index in model.meta.indexes:
+                    cursor.execute(_create_indexstring(backend, model, index))
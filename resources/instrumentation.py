@@ -0,0 +1,158 @@
+"""
+Visibility into the statements the ORM sends to the database.
+
+    register(post_execute=lambda event: print(event.sql, event.duration))  # Called for every statement.
+    set_slow_query_threshold(0.1)  # Log statements taking longer than 100 ms to the 'myqueryorm.slow' logger.
+
+    with collect(n_plus_one=10) as log:  # Such as per web request.
+        for user in User.objects:
+            user.group  # Warns once the group of more than 10 users has been queried separately.
+    print(log.count, log.duration)
+
+Nothing is measured while no hooks, slow query threshold or collectors are in use.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run instrumentation.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run instrumentation.py instead of app.py. This, sadly, will not work :(")
+
+import warnings
+from logging import getLogger
+from time import perf_counter
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, NamedTuple, Type, TYPE_CHECKING
+from resources.exceptions import NPlusOneWarning
+
+if TYPE_CHECKING:
+    from mysql.connector.cursor import CursorBase
+    from resources.orm import DBModel
+    from resources.utils import DatabaseConnection
+
+slow_query_logger = getLogger('myqueryorm.slow')
+
+
+class QueryEvent(NamedTuple):
+    """ Describes a statement sent by the ORM, passed to the hooks. """
+    sql: str
+    params: tuple[Any, ...]
+    duration: float | None  # Seconds spent executing the statement, and fetching its rows. None before it is executed.
+    rowcount: int | None  # Rows returned or changed. None before the statement is executed, -1 for streamed results.
+    model: Type['DBModel'] | None
+    source: Any  # The QuerySet or model instance which sent the statement.
+
+
+class QueryLog:
+    """ The statements sent within a collect() block. """
+
+    queries: list[QueryEvent]
+    lazy_loads: Counter[tuple[str, str]]  # Foreign keys queried by their getter, counted per model and field.
+    n_plus_one: int | None
+
+    def __init__(self, n_plus_one: int = None) -> None:
+        self.queries = []
+        self.lazy_loads = Counter()
+        self.n_plus_one = n_plus_one
+        super().__init__()
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def duration(self) -> float:
+        """ Total seconds spent on the statements. """
+        return sum(event.duration for event in self.queries)
+
+    def __str__(self) -> str:
+        return f"{self.count} queries in {self.duration * 1000:.1f} ms"
+
+
+_pre_execute: list[Callable[[QueryEvent], None]] = []
+_post_execute: list[Callable[[QueryEvent], None]] = []
+_slow_query_threshold: float | None = None
+_collectors: ContextVar[tuple[QueryLog, ...]] = ContextVar('collectors', default=())
+
+
+def register(pre_execute: Callable[[QueryEvent], None] = None, post_execute: Callable[[QueryEvent], None] = None) -> None:
+    """
+    :param pre_execute: Called before every statement is executed, without its duration and rowcount.
+    :param post_execute: Called after every statement is executed successfully.
+    """
+    if pre_execute is not None:
+        _pre_execute.append(pre_execute)
+    if post_execute is not None:
+        _post_execute.append(post_execute)
+
+
+def unregister(pre_execute: Callable[[QueryEvent], None] = None, post_execute: Callable[[QueryEvent], None] = None) -> None:
+    if pre_execute is not None:
+        _pre_execute.remove(pre_execute)
+    if post_execute is not None:
+        _post_execute.remove(post_execute)
+
+
+def set_slow_query_threshold(seconds: float | None) -> None:
+    """ Logs statements taking at least this many seconds as warnings of the 'myqueryorm.slow' logger, None disables it. """
+    global _slow_query_threshold
+    _slow_query_threshold = seconds
+
+
+@contextmanager
+def collect(n_plus_one: int = None) -> Iterator[QueryLog]:
+    """
+    Collects the statements sent by the current thread or asyncio task, for the duration of the block.
+    :param n_plus_one: Warn with an NPlusOneWarning, once the same foreign key is queried by its getter more times than this.
+    """
+    log = QueryLog(n_plus_one)
+    token = _collectors.set((*_collectors.get(), log))
+    try:
+        yield log
+    finally:
+        _collectors.reset(token)
+
+
+def lazy_load(model: Type['DBModel'], field: str) -> None:
+    """ Called by the getter of a foreign key field, before querying the related row. """
+    for log in _collectors.get():
+        key = model.__name__, field
+        log.lazy_loads[key] += 1
+        if log.n_plus_one is not None and log.lazy_loads[key] == log.n_plus_one + 1:
+            warnings.warn(f"{model.__name__}.{field} was queried more than {log.n_plus_one} times, "
+                          f"consider select_related('{field}') or prefetch_related('{field}')", NPlusOneWarning, stacklevel=3)
+
+
+def execute(connection: 'DatabaseConnection', sql: str, params: tuple[Any, ...] = (), source: Any = None,
+            fetch: bool = False) -> 'list[tuple[Any, ...]] | CursorBase':
+    """
+    Executes the statement through DatabaseConnection.execute(), reporting it to the hooks, collectors and slow query log.
+
+    :param source: The QuerySet or model instance sending the statement.
+    :param fetch: Fetch and return every row of the result, rather than the cursor.
+    """
+    collectors = _collectors.get()
+    if not (_pre_execute or _post_execute or collectors or _slow_query_threshold is not None):
+        cursor = connection.execute(sql, params)
+        return cursor.fetchall() if fetch else cursor
+
+    model = source if isinstance(source, type) else getattr(source, 'model', None)
+    if _pre_execute:
+        event = QueryEvent(sql, params, None, None, model, source)
+        for hook in _pre_execute:
+            hook(event)
+
+    started = perf_counter()
+    cursor = connection.execute(sql, params)
+    result = cursor.fetchall() if fetch else cursor
+    duration = perf_counter() - started
+
+    event = QueryEvent(sql, params, duration, len(result) if fetch else cursor.rowcount, model, source)
+    for log in collectors:
+        log.queries.append(event)
+    for hook in _post_execute:
+        hook(event)
+    if _slow_query_threshold is not None and duration >= _slow_query_threshold:
+        slow_query_logger.warning("Slow query (%.1f ms): %s %r", duration * 1000, sql, params)
+
+    return result
@@ -4,6 +4,21 @@ from resources import orm
 
 class StringField(NamedTuple):
     length: int
+    index: bool = False  # Create an index on the column, for faster lookups.
+    unique: bool = False  # Create a unique index on the column.
+
+
+class Index(NamedTuple):
+    """
+    Index on one or more fields of a model, declared in the indexes of its Meta class:
+
+        class Meta:
+            indexes = (Index(('name', 'age')), ('name', 'group'))  # Plain tuples of fields are also accepted.
+            unique_together = (('name', 'group'),)
+    """
+    fields: tuple[str, ...]
+    unique: bool = False
+    name: str = None  # Named after its table and columns by default.
 
 
 class PKField(NamedTuple):
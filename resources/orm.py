@@ -1,55 +1,122 @@
 """
 Stores database data and queryset models.
 """
-from types import NoneType
+from types import NoneType, FunctionType
 
-from resources.modelfields import StringField
+from resources.modelfields import StringField, Index
 
 if __name__ == '__main__':
     # Gently remind the user to not run program.py themselves
     raise SystemExit("(⊙＿⊙') Wha!?... Are you trying to run orm.py?\n"
                      " You know this is a bad idea; right? You should run app.py instead :)")
 
+import json
 from copy import copy
+from binascii import Error as Base64Error
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from functools import partial
+from itertools import islice
+from collections import namedtuple
 from inspect import isclass
-from .utils import ConnectionSingleton
+from .utils import DatabaseConnection, ConnectionPool
 from mysql.connector.cursor import CursorBase
+from resources import compiler
+from resources.aio import run_in_executor, submit
+from resources.session import current_session
+from resources.cache import get_cache
+from resources.transaction import in_atomic, defer_invalidation
+from resources.routing import ReplicaRouter
+from resources.sharding import Sharding, fan_out, merge
+from resources import instrumentation
 from resources.init import foreignkey_relationships
 from mysql.connector.connection import MySQLConnection
 from resources.enums import FieldTypes, DatabaseLocations
 from resources.exceptions import AbstractInstantiationError
-from typing import Any, Union, ItemsView, ValuesView, Type, NamedTuple, Callable
+from concurrent.futures import Future
+from typing import Any, Union, ItemsView, ValuesView, Type, NamedTuple, Callable, Iterator, Iterable, ContextManager
+
+# Number of primary keys per IN (...) query when prefetching.
+# At most ~12 bytes per key, this keeps statements well below the smallest default max_allowed_packet (4 MB).
+PREFETCH_CHUNK_SIZE = 10_000
+
+
+def _invalidate(model: Type['DBModel'], connection: DatabaseConnection) -> None:
+    """ Drops the cached results reading the table of the model, after writing it over the connection. """
+    if (cache := get_cache()) is not None:
+        # Other threads may only cache the new rows once they are committed, unless written outside the transaction.
+        if connection.atomic_depth and in_atomic():
+            defer_invalidation(model.meta.table_name)
+        else:
+            cache.invalidate(model.meta.table_name)
 
 
 class Q:
-    _conditions: list[dict[str, Any], ...] = None
+    """
+    Immutable condition tree for QuerySet.filter() and exclude(), combined using &, | and ~
+    Keyword conditions are combined with AND, and may use the lookups of resources.compiler.LOOKUPS; e.g. Q(name__in=('a', 'b'))
+    """
+    AND = 'AND'
+    OR = 'OR'
 
-    def __init__(self, **conditions) -> None:
-        if not conditions:
+    children: tuple[Union['Q', tuple[str, Any]], ...] = ()
+    connector: str = AND
+    negated: bool = False
+
+    def __init__(self, *children: 'Q', _connector: str = AND, _negated: bool = False, **conditions) -> None:
+        if not children and not conditions:
             raise ValueError("No conditions specified for Q() instance")
-        self._conditions = [conditions]
+        self.children = (*children, *conditions.items())
+        self.connector = _connector
+        self.negated = _negated
         super().__init__()
 
-    def __or__(self, other: 'Q'):
+    def _combine(self, other: 'Q', connector: str) -> 'Q':
         if not isinstance(other, Q):
-            raise TypeError("OR with Q() instances, can only be done with other Q() instances.")
-        self._conditions += other._conditions
+            raise TypeError(f"{connector} with Q() instances, can only be done with other Q() instances.")
+        return Q(self, other, _connector=connector)
+
+    def __or__(self, other: 'Q') -> 'Q':
+        return self._combine(other, self.OR)
+
+    def __and__(self, other: 'Q') -> 'Q':
+        return self._combine(other, self.AND)
+
+    def __invert__(self) -> 'Q':
+        return Q(self, _negated=True)
 
-    def __and__(self, other):
-        if not isinstance(other, Q):
-            raise TypeError("OR with Q() instances, can only be done with other Q() instances.")
-        self._conditions[-1] |= {key:val for d in other._conditions for key,val in d.items()}
+
+class Page(NamedTuple):
+    """ A page of QuerySet.paginate_by() """
+    items: tuple[Any, ...]
+    next_cursor: str | None  # Pass as after= for the next page, None on the last page.
 
 
 class QuerySet:
     """
     Django'esque queryet class which allows for retrieving a list of models from the database.
-    Currently only able to retrieve all rows of a table.
+    Querysets are lazy and immutable; filter(), exclude(), order_by() and the like return new querysets,
+    which are compiled to a single statement, that is only executed when the queryset is first needed.
     """
     model: 'DBModel' = None
     _result: tuple['DBModel', ...] = None
-    _filter: str = None
-    _values: list[str] = None
+    _where: Q = None  # Condition tree of every filter() and exclude() so far.
+    _order_by: tuple[str, ...] = ()
+    _values: tuple[str, ...] = None  # Fields selected by values() or values_list(), which then return rows rather than instances.
+    _values_mode: str = None  # One of the VALUES_ constants below.
+    _values_row: Type[tuple] = None  # Named tuple class for values_list(named=True)
+    _readonly: bool = False  # Instances don't keep a snapshot of their initial values.
+    _primary: bool = False  # Read from the primary, rather than a replica of a ReplicaRouter.
+    _pending: Future = None  # Evaluation started by prefetch(), resolving to the result.
+    _limit: int | None = None  # Rows of the slice taken by __getitem__(), None for slices without an end.
+    _offset: int = 0
+    _seek: tuple[str, bool, tuple[Any, ...]] = None  # Field, descending and parameters of the condition of paginate_by()
+
+    VALUES_DICT = 'dict'
+    VALUES_TUPLE = 'tuple'
+    VALUES_FLAT = 'flat'
+    VALUES_NAMED = 'named'
+    _select_related: tuple[str, ...] = ()  # Foreign key fields to load with a JOIN, rather than lazily.
+    _prefetch_related: tuple[str, ...] = ()  # Relations to load with separate IN queries, after evaluating.
 
     def __init__(self, model) -> None:
         """
@@ -57,63 +124,444 @@ class QuerySet:
         """
         super().__init__()
         self.model: Type[DBModel] = model
-        self._result: list[DBModel] = []  # Ensure the list is an instance variable
+        self._result: list[DBModel] = None  # Ensure the result is an instance variable, evaluated when first needed.
+
+    def _clone(self, **changes) -> 'QuerySet':
+        """ :return: An unevaluated copy of the queryset, with the provided attributes changed. """
+        clone = copy(self)
+        clone._result = None
+        clone._pending = None
+        for attribute, value in changes.items():
+            setattr(clone, attribute, value)
+        return clone
+
+    def _compile_where(self) -> tuple[str | None, tuple[Any, ...]]:
+        where, params = compiler.compile_where(self.model, self._where) if self._where else (None, ())
+        if self._seek is not None:
+            field, descending, seek_params = self._seek
+            seek = compiler.compile_seek(self.model, field, descending)
+            where, params = (f"({where}) AND {seek}" if where else seek), (*params, *seek_params)
+        return where, params
 
-    def evaluate(self):
-        """ Performs the query and caches the result. """
+    @property
+    def _sliced(self) -> bool:
+        return self._limit is not None or self._offset > 0
+
+    def _compile(self) -> tuple[str, tuple[Any, ...]]:
+        """ :return: The SELECT statement of the queryset, and its parameters. """
+        where, params = self._compile_where()
+        order_by = compiler.compile_order_by(self.model, self._order_by) if self._order_by else None
+        if self._sliced:
+            params = (*params, compiler.NO_LIMIT if self._limit is None else self._limit, self._offset)
+        if self._values is not None:  # Only the selected columns, related rows would not be returned anyway.
+            columns = tuple(compiler.resolve_column(self.model, field) for field in self._values)
+            return compiler.compile_select(self.model, where=where, order_by=order_by, columns=columns, sliced=self._sliced), params
+        return compiler.compile_select(self.model, self._select_related, where, order_by, sliced=self._sliced), params
+
+    def _fetch(self, sql: str, params: tuple[Any, ...], select: bool = False) -> list[tuple[Any, ...]]:
+        """
+        Executes the statement, and returns every row of its result; from the result cache when it is enabled.
+        :param select: The statement is the SELECT of the queryset, whose rows of every shard are merged by order_by() and sliced.
+        """
+        # Uncommitted rows must not be cached, and reads of the primary must not be served rows cached from a lagging replica.
+        if (cache := get_cache()) is not None and not in_atomic() and not self._reads_primary():
+            tables = (self.model.meta.table_name, *(getattr(self.model, field).model.meta.table_name for field in self._select_related))
+            return cache.fetch(self.model, tables, sql, params, partial(self._query, sql, params, select))
+        return self._query(sql, params, select)
+
+    def _reads_primary(self) -> bool:
+        """ :return: Whether the queryset reads from the primary of a ReplicaRouter with replicas, rather than a replica. """
+        return any(isinstance(connection, ReplicaRouter) and connection.replicas and (self._primary or connection.reads_primary())
+                   for connection in self._shards() or (self.model.meta.connection,))
+
+    def _holds_connection(self) -> bool:
+        """ :return: Whether the current thread holds a single connection the queryset may read from, which a worker thread would wait for. """
+        for connection in self._shards() or (self.model.meta.connection,):
+            connections = (connection.primary, *connection.replicas) if isinstance(connection, ReplicaRouter) else (connection,)
+            if any(isinstance(connection, DatabaseConnection) and connection.held() for connection in connections):
+                return True
+        return False
+
+    def _acquire_read(self, exclusive: bool = False, connection: DatabaseConnection | ConnectionPool | ReplicaRouter = None) -> ContextManager[DatabaseConnection]:
+        """
+        Acquires the connection to read the rows of the queryset from; a replica, when routed by a ReplicaRouter.
+        :param connection: The shard to read from, when the model is sharded.
+        """
+        if connection is None:
+            connection = self.model.meta.connection
+        if isinstance(connection, ReplicaRouter) and not self._primary:
+            return connection.acquire_read(exclusive)
+        return connection.acquire(exclusive)
+
+    def _shards(self) -> tuple[DatabaseConnection | ConnectionPool | ReplicaRouter, ...] | None:
+        """ :return: The shards which may hold the rows of the queryset, None when the model isn't sharded. """
+        sharding = self.model.meta.connection
+        return sharding.shards_for(self.model, self._where) if isinstance(sharding, Sharding) else None
+
+    def _merge_order(self) -> tuple[tuple[int, bool], ...]:
+        """ :return: (index, descending) of the selected columns of order_by(), which the rows of every shard are merged by. """
+        columns = self.model.meta.columns if self._values is None else \
+            tuple(compiler.resolve_column(self.model, field) for field in self._values)
+        order = []
+        for field in self._order_by:
+            column = compiler.resolve_column(self.model, field.lstrip('-'))
+            if column not in columns:
+                raise ValueError(f"Rows of sharded {self.model.__name__} can only be ordered by {field} when it is selected by values()")
+            order.append((columns.index(column), field.startswith('-')))
+        return tuple(order)
+
+    def _shard_slice(self, params: tuple[Any, ...]) -> tuple[tuple[Any, ...], int | None, int | None]:
+        """
+        Every shard selects its rows up to the end of the slice, which is taken from their merged rows instead.
+        :return: The parameters of the SELECT for the shards, and the start and stop of the slice of the merged rows.
+        """
+        if not self._sliced:
+            return params, None, None
+        stop = None if self._limit is None else self._offset + self._limit
+        return (*params[:-2], compiler.NO_LIMIT if stop is None else stop, 0), self._offset, stop
+
+    def _query(self, sql: str, params: tuple[Any, ...], select: bool = False) -> list[tuple[Any, ...]]:
+        """ Queries the connection of the model; or, when sharded, the shards which may hold its rows concurrently, merging their rows. """
+        if (shards := self._shards()) is None:
+            return self._query_shard(sql, params)
+        if not select:
+            return list(merge(fan_out(partial(self._query_shard, sql, params), shards)))
 
-        connection = self.model.meta.connection.connection
-        cursor = self.model.meta.connection.cursor
+        params, start, stop = self._shard_slice(params)
+        rows = merge(fan_out(partial(self._query_shard, sql, params), shards), self._merge_order(), self.model.meta.connection.backend.sort_key)
+        return list(rows if start is None else islice(rows, start, stop))
 
-        try: connection.consume_results()
-        except Exception: pass
+    def _query_shard(self, sql: str, params: tuple[Any, ...], shard: DatabaseConnection | ConnectionPool | ReplicaRouter = None) -> list[tuple[Any, ...]]:
+        with self._acquire_read(connection=shard) as connection:
+            try: connection.consume_results()
+            except Exception: pass
 
-        current_table: str = self.model.meta.table_name
-        sql = f"SELECT * FROM {self.model.meta.database_name}.{current_table}"
-        if self._filter:
-            sql += f"WHERE {self._filter}"
+            return instrumentation.execute(connection, sql, params, self, fetch=True)
 
-        cursor.execute(f"SELECT * FROM {self.model.meta.database_name}.{current_table} {self._filter}")
+    def evaluate(self):
+        """ Performs the query and caches the result; or waits for the result, when prefetch() already started the query. """
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            self._result = pending.result()
+            return self
 
-        buffer = *(i for i in cursor),  # Buffer needed for certain tables for some reason.
-        self._result = *(Models[current_table](obj) for obj in buffer),
+        self._result = self._load()
         return self
 
-    def filter(self, **kwargs):
-        if not kwargs:
-            raise ValueError("No conditions specified for QuerySet.filter")
+    def _load(self) -> tuple[Any, ...]:
+        return tuple(self._convert(self._fetch(*self._compile(), select=True)))
 
-        connection = self.model.meta.connection.connection
-        cursor = self.model.meta.connection.cursor
+    def prefetch(self):
+        """
+        Starts evaluating the queryset on a worker thread of resources.aio, while the calling thread goes on.
+        Using the result, such as by iterating the queryset, waits for the query to finish.
+        Within atomic() blocks the queryset is evaluated at once instead, on the connection of the transaction;
+        as it is when the calling thread holds the single connection it reads from, such as while looping over iterator().
 
-        try: connection.consume_results()
-        except Exception: pass
+        :return: The queryset itself.
+        """
+        if self._result is None and self._pending is None:
+            if in_atomic() or self._holds_connection():
+                self.evaluate()
+            else:
+                self._pending = submit(self._load)
+        return self
 
-        # Format kwargs for query
-        for arg, value in kwargs.items():  # TODO Kevin: Maybe check for SQL injection here, also should probably use _sql_value_formatter()
-            if isinstance(value, str):  # Strings should be quoted
-                kwargs[arg] = f"\'{value}\'"
+    def count(self) -> int:
+        """ :return: The number of rows matched by the queryset, counted by the database unless already evaluated. """
+        if self._pending is not None or self._sliced:  # Slices are counted from their rows, which they limit anyway.
+            self.evaluate()
+        if self._result is not None:
+            return len(self._result)
+        where, params = self._compile_where()
+        return sum(row[0] for row in self._fetch(compiler.compile_count(self.model, where), params))  # A count per shard.
+
+    def exists(self) -> bool:
+        """ :return: Whether the queryset matches any rows, without retrieving them unless already evaluated. """
+        if self._pending is not None:
+            self.evaluate()
+        if self._result is not None:
+            return bool(self._result)
+        if self._sliced:
+            return bool(self[:1]._load())
+        where, params = self._compile_where()
+        return bool(self._fetch(compiler.compile_exists(self.model, where), params))
+
+    def iterator(self, chunk_size: int = 2000) -> Iterator['DBModel']:
+        """
+        Streams the rows of the queryset from the server, creating instances chunk_size rows at a time.
+        Unlike iterating the queryset itself, the instances are not cached on the queryset,
+        such that memory is bounded by chunk_size rather than the size of the table.
+
+        The rows are streamed over a connection of their own when using a ConnectionPool, which leaves the connection
+        of the thread free for other queries; such as loading the relations passed to prefetch_related() per chunk.
+        A single MySQL connection can't run other queries until the iteration is done, which raises a RuntimeError
+        rather than cutting the iteration short; prefetch_related() and lazy foreign keys included.
+        Use select_related() to load foreign keys in that case.
+        Sharded models stream the rows of every shard at once, merged by their order_by().
+
+        :param chunk_size: Number of rows to read from the cursor at once.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+
+        sql, params = self._compile()
+
+        if (shards := self._shards()) is not None:
+            params, start, stop = self._shard_slice(params)
+            streams = [self._stream_shard(sql, params, chunk_size, shard) for shard in shards]
+            rows = merge(streams, self._merge_order(), self.model.meta.connection.backend.sort_key)
+            if start is not None:
+                rows = islice(rows, start, stop)
+            try:
+                while chunk := list(islice(rows, chunk_size)):
+                    yield from self._convert(chunk)
+            finally:
+                for stream in streams:
+                    stream.close()
+            return
+
+        with self._acquire_read(exclusive=True) as connection:
+            try: connection.consume_results()
+            except Exception: pass
+
+            cursor = instrumentation.execute(connection, sql, params, self)  # Prepared cursors don't buffer their rows.
+            connection.streaming = not connection.backend.interleaved_results
+            try:
+                while rows := cursor.fetchmany(chunk_size):
+                    yield from self._convert(rows)
+            finally:
+                connection.streaming = False
+                # When the iteration is abandoned, the remaining rows must still be read before the connection is reused.
+                try: connection.consume_results()
+                except Exception: pass
+
+    def _stream_shard(self, sql: str, params: tuple[Any, ...], chunk_size: int,
+                      shard: DatabaseConnection | ConnectionPool | ReplicaRouter) -> Iterator[tuple[Any, ...]]:
+        """ Streams the rows of the statement from a single shard, for iterator() """
+        with self._acquire_read(exclusive=True, connection=shard) as connection:
+            try: connection.consume_results()
+            except Exception: pass
+
+            cursor = instrumentation.execute(connection, sql, params, self)
+            connection.streaming = not connection.backend.interleaved_results
+            try:
+                while rows := cursor.fetchmany(chunk_size):
+                    yield from rows
+            finally:
+                connection.streaming = False
+                try: connection.consume_results()
+                except Exception: pass
+
+    def _convert(self, rows: list[tuple[Any, ...]]) -> list[Any]:
+        """ Converts the selected rows to what the queryset returns; instances, or the rows of values() and values_list() """
+        if self._values is None:
+            return self._instances(rows)
+        elif self._values_mode == self.VALUES_TUPLE:
+            return rows
+        elif self._values_mode == self.VALUES_FLAT:
+            return [row[0] for row in rows]
+        elif self._values_mode == self.VALUES_NAMED:
+            return [self._values_row._make(row) for row in rows]
+        return [dict(zip(self._values, row)) for row in rows]
+
+    def values(self, *fields: str):
+        """
+        :param fields: Fields (or columns) to select, all of them if none are provided. Foreign keys select the related PK.
+        :return: A new queryset, returning a dictionary per row rather than model instances.
+        """
+        return self._clone_values(fields, self.VALUES_DICT)
 
-        def _init_values(row: tuple[Any, ...]) -> DBModel:
-            """ Also set the primary key for model instances retrieved from the database. """
-            obj = self.model(*(row[1:]))
-            obj._pk = row[0]
-            return obj
+    def values_list(self, *fields: str, flat: bool = False, named: bool = False):
+        """
+        :param fields: Fields (or columns) to select, all of them if none are provided. Foreign keys select the related PK.
+        :param flat: Return the single selected value of each row, rather than a tuple.
+        :param named: Return named tuples, rather than plain tuples.
+        :return: A new queryset, returning a tuple per row rather than model instances.
+        """
+        if flat and named:
+            raise TypeError("values_list() can't be both flat and named")
+        if flat and len(fields) != 1:
+            raise TypeError("values_list(flat=True) requires exactly one field")
+        return self._clone_values(fields, self.VALUES_FLAT if flat else self.VALUES_NAMED if named else self.VALUES_TUPLE)
 
-        cursor.execute(f"SELECT * FROM {self.model.meta.database_name}.{self.model.meta.table_name} WHERE {'AND'.join(('{} = {}'.format(key, value) for key, value in kwargs.items()))}")
-        self._result: list[Any] = [_init_values(obj) for obj in cursor]
-        return self
+    def readonly(self):
+        """
+        :return: A new queryset, whose instances don't keep a snapshot of their initial values, saving memory for large results.
+            Saving such an instance writes every assigned field, even when assigned the value it already had.
+        """
+        return self._clone(_readonly=True)
+
+    def using_primary(self):
+        """ :return: A new queryset, reading from the primary rather than a replica, when the model is routed by a ReplicaRouter. """
+        return self._clone(_primary=True)
+
+    def _clone_values(self, fields: tuple[str, ...], mode: str) -> 'QuerySet':
+        fields = fields or ('pk', *self.model.meta.fields.keys())
+        for field in fields:
+            compiler.resolve_column(self.model, field)  # Fail early on invalid fields.
+        values_row = namedtuple('Row', fields, rename=True) if mode == self.VALUES_NAMED else None
+        return self._clone(_values=fields, _values_mode=mode, _values_row=values_row)
+
+    def _instances(self, rows: Iterable[tuple[Any, ...]]) -> list['DBModel']:
+        """ Creates instances from the selected rows, along with the related instances of select_related() and prefetch_related(). """
+        accessors: list[LazygetterWrapper] = [getattr(self.model, field) for field in self._select_related]
+        snapshot = not self._readonly
+        session = current_session()  # Rows already in the session keep their instance.
+        from_row = self.model._from_row if session is None else partial(session.load, self.model)
+
+        if not accessors:  # The rows hold just the columns of the model itself.
+            result = [from_row(row, snapshot) for row in rows]
+        else:
+            base_width = len(self.model.meta.columns)
+            result = []
+            for row in rows:
+                instance = from_row(row[:base_width], snapshot)
+
+                # Slice out the columns of every joined table, and place the related instances in the foreign key slots.
+                offset = base_width
+                for accessor in accessors:
+                    width = len(accessor.model.meta.columns)
+                    related_row = row[offset:offset + width]
+                    offset += width
+                    # A NULL primary key means the LEFT JOIN found no related row.
+                    if related_row[0] is None:
+                        related = None
+                    elif session is None:
+                        related = accessor.model._from_row(related_row, snapshot)
+                    else:
+                        related = session.load(accessor.model, related_row, snapshot)
+                    setattr(instance, accessor.slot, related)
+
+                result.append(instance)
+
+        if self._prefetch_related:
+            self._prefetch(result)
+
+        return result
+
+    def _in_chunks(self, model: Type['DBModel'], column: str, values: set[int]) -> Iterator['DBModel']:
+        """ Retrieves the rows of the model where the column is in values, using as few queries as the packet size allows. """
+        queryset = QuerySet(model)._clone(_readonly=self._readonly, _primary=self._primary)
+        values = sorted(values)
+        chunk_size = min(PREFETCH_CHUNK_SIZE, model.meta.connection.backend.max_placeholders)
+        for start in range(0, len(values), chunk_size):
+            yield from queryset.filter(**{f"{column}__in": values[start:start + chunk_size]}).evaluate()
+
+    def _prefetch(self, instances: list['DBModel']) -> None:
+        """ Loads the relations passed to prefetch_related() for the provided instances, one query per relation. """
+        for lookup in self._prefetch_related:
+            accessor = getattr(self.model, lookup)
+
+            if isinstance(accessor, LazygetterWrapper):  # Forward foreign key, load the referenced rows by their PK.
+                fk_model, slot = accessor.model, accessor.slot
+                fk_ids = {fk_id for instance in instances if isinstance(fk_id := getattr(instance, slot), int)}
+                related = {}
+                if (session := current_session()) is not None:  # Only query the rows not already in the session.
+                    related = {fk_id: obj for fk_id in fk_ids if (obj := session.get(fk_model, fk_id)) is not None}
+                related.update((obj.pk, obj) for obj in self._in_chunks(fk_model, fk_model.meta.pk_column, fk_ids - related.keys()))
+                for instance in instances:
+                    if isinstance(fk_id := getattr(instance, slot), int):
+                        setattr(instance, slot, related.get(fk_id, fk_id))
+
+            else:  # Reverse relation, load every row referring back to the provided instances.
+                slot = getattr(accessor.model, accessor.field).slot
+                parents = {instance.pk: instance for instance in instances}
+                children: dict[int, list[DBModel]] = {pk: [] for pk in parents}
+                for child in self._in_chunks(accessor.model, self.model.meta.pk_column, set(parents)):
+                    # Children already in the session may hold the instance of their parent, rather than its PK.
+                    related = getattr(child, slot)
+                    parent = parents.get(related.pk if isinstance(related, DBModel) else related, None)
+                    if parent is None:  # Assigned another parent in memory, since it was loaded by the session.
+                        continue
+                    setattr(child, slot, parent)  # The referenced instance is already at hand.
+                    children[parent.pk].append(child)
+                for pk, parent in parents.items():
+                    if parent._prefetched is None:
+                        parent._prefetched = {}
+                    parent._prefetched[lookup] = tuple(children[pk])
+
+    def select_related(self, *fields: str):
+        """
+        Load the specified foreign key fields in the same query as the queryset itself, using a JOIN.
+        Accessing these fields on the resulting instances will then not query the database again.
 
-    def get(self, **kwargs):
+        :param fields: Names of foreign key fields on the model.
+        """
+        if not fields:
+            raise ValueError("No fields specified for QuerySet.select_related")
 
-        self.filter(**kwargs)
+        for field in fields:
+            if not isinstance(accessor := getattr(self.model, field, None), LazygetterWrapper):
+                raise AttributeError(f"{field} is not a foreign key field for {self.model}")
+            if isinstance(self.model.meta.connection, Sharding) or isinstance(accessor.model.meta.connection, Sharding):
+                raise ValueError(f"Cannot join {field} of {self.model}, as the rows are stored in different databases; use prefetch_related()")
 
-        if len(self._result) < 1:
+        return self._clone(_select_related=self._select_related + tuple(field for field in fields if field not in self._select_related))
+
+    def prefetch_related(self, *lookups: str):
+        """
+        Load the specified relations with one additional query per relation, once the queryset itself is evaluated.
+        Unlike select_related(), this also supports reverse relations, such as NotSQLGroup.user_set
+
+        :param lookups: Names of foreign key fields or reverse relations on the model.
+        """
+        if not lookups:
+            raise ValueError("No relations specified for QuerySet.prefetch_related")
+
+        for lookup in lookups:
+            if not isinstance(getattr(self.model, lookup, None), (LazygetterWrapper, ReverseLazygetterWrapper)):
+                raise AttributeError(f"{lookup} is not a relation for {self.model}")
+
+        return self._clone(_prefetch_related=self._prefetch_related + tuple(lookup for lookup in lookups if lookup not in self._prefetch_related))
+
+    def _check_unsliced(self, operation: str) -> None:
+        if self._sliced:
+            raise TypeError(f"Cannot {operation} a queryset once a slice has been taken")
+
+    def _add_condition(self, condition: Q) -> 'QuerySet':
+        self._check_unsliced('filter')
+        for key, _ in (child for child in condition.children if not isinstance(child, Q)):
+            compiler.resolve_lookup(self.model, key)  # Fail early on invalid fields.
+        return self._clone(_where=condition if self._where is None else self._where & condition)
+
+    def filter(self, *conditions: Q, **kwargs):
+        """
+        :param conditions: Q() instances the rows must match.
+        :param kwargs: Fields (or columns) paired with the value they must match, see Q() for lookups.
+        :return: A new queryset, matching only the rows that also match the conditions.
+        """
+        if not conditions and not kwargs:
+            raise ValueError("No conditions specified for QuerySet.filter")
+        return self._add_condition(Q(*conditions, **kwargs))
+
+    def exclude(self, *conditions: Q, **kwargs):
+        """ :return: A new queryset, leaving out the rows matching all the conditions. Takes the same arguments as filter(). """
+        if not conditions and not kwargs:
+            raise ValueError("No conditions specified for QuerySet.exclude")
+        return self._add_condition(~Q(*conditions, **kwargs))
+
+    def order_by(self, *fields: str):
+        """
+        :param fields: Fields (or columns) to order by, descending when prefixed with '-'. Replaces any previous ordering.
+        :return: A new queryset, ordered by the fields.
+        """
+        self._check_unsliced('reorder')
+        for field in fields:
+            compiler.resolve_column(self.model, field.lstrip('-'))  # Fail early on invalid fields.
+        return self._clone(_order_by=fields)
+
+    def get(self, *conditions: Q, **kwargs):
+
+        queryset = self.filter(*conditions, **kwargs) if conditions or kwargs else self
+        queryset.evaluate()
+
+        if len(queryset._result) < 1:
             raise LookupError("Get did not return any results.")
-        elif len(self._result) > 1:
+        elif len(queryset._result) > 1:
             raise LookupError("Get returned more than one result.")
 
-        return self._result[0]
+        return queryset._result[0]
 
     def __iter__(self):
         if self._result is None:
@@ -121,15 +569,110 @@ class QuerySet:
         for instance in self._result:
             yield instance
 
+    async def aevaluate(self):
+        """ Counterpart of evaluate(), for use in asyncio event loops. """
+        return await run_in_executor(self.evaluate)
+
+    async def afilter(self, *conditions: Q, **kwargs):
+        """ Counterpart of filter(), returning the new queryset already evaluated, for use in asyncio event loops. """
+        return await self.filter(*conditions, **kwargs).aevaluate()
+
+    async def aget(self, *conditions: Q, **kwargs):
+        """ Counterpart of get(), for use in asyncio event loops. """
+        return await run_in_executor(self.get, *conditions, **kwargs)
+
+    async def acount(self) -> int:
+        """ Counterpart of count(), for use in asyncio event loops. """
+        return await run_in_executor(self.count)
+
+    async def aexists(self) -> bool:
+        """ Counterpart of exists(), for use in asyncio event loops. """
+        return await run_in_executor(self.exists)
+
+    async def __aiter__(self):
+        if self._result is None:
+            await self.aevaluate()
+        for instance in self._result:
+            yield instance
+
     def __len__(self):
         if self._result is None:
             self.evaluate()
         return len(self._result)
 
-    def __getitem__(self, item):
-        if self._result is None:
+    def __getitem__(self, item: int | slice):
+        """
+        Indexes the result once evaluated. Until then slices return a new queryset, selecting only the rows of the slice
+        through LIMIT and OFFSET; and indexes select just the row, raising IndexError when there is none.
+        Slices with a step are evaluated, and return a list.
+        """
+        if self._pending is not None:
             self.evaluate()
-        return self._result[item]
+        if self._result is not None:
+            return self._result[item]
+
+        if isinstance(item, slice):
+            if (item.start or 0) < 0 or (item.stop or 0) < 0:
+                raise ValueError("Querysets can't be sliced from their end")
+            queryset = self._slice(item.start or 0, item.stop)
+            return queryset if item.step in (None, 1) else list(queryset)[::item.step]
+
+        if item < 0:
+            raise ValueError("Querysets can't be indexed from their end")
+        result = self._slice(item, item + 1)._load()
+        if not result:
+            raise IndexError("QuerySet index out of range")
+        return result[0]
+
+    def _slice(self, start: int, stop: int | None) -> 'QuerySet':
+        """ :return: A new queryset, selecting the rows from start up to stop of the current slice. """
+        limit = None if stop is None else max(stop - start, 0)
+        if self._limit is not None:
+            remaining = max(self._limit - start, 0)
+            limit = remaining if limit is None else min(limit, remaining)
+        return self._clone(_offset=self._offset + start, _limit=limit)
+
+    def paginate_by(self, order_field: str, page_size: int, after: str = None) -> Page:
+        """
+        Keyset pagination, seeking past the rows of the previous pages through an indexable condition rather than an OFFSET;
+        such that every page takes about as long to select, however deep it is.
+        The rows are ordered by the field, followed by the primary key to break ties. Rows with a NULL field are left out.
+
+            page = User.objects.paginate_by('-age', 20)
+            next_page = User.objects.paginate_by('-age', 20, after=page.next_cursor)
+
+        :param order_field: Field (or column) to order by, descending when prefixed with '-'.
+        :param page_size: Number of rows per page.
+        :param after: next_cursor of the previous page, None for the first page.
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be a positive integer")
+        if self._values is not None:
+            raise TypeError("paginate_by() can't be used with values() or values_list()")
+
+        descending = order_field.startswith('-')
+        field = order_field.lstrip('-')
+        column = compiler.resolve_column(self.model, field)
+        pk_ordered = column == self.model.meta.pk_column
+        if pk_ordered:
+            queryset = self.order_by(order_field)
+        else:  # NULL never compares greater or less than the field of the cursor, so pages would be cut short at them.
+            queryset = self.filter(**{f"{field}__isnull": False}).order_by(order_field, '-pk' if descending else 'pk')
+
+        if after is not None:
+            try:
+                value, pk = json.loads(urlsafe_b64decode(after.encode()))
+            except (Base64Error, ValueError, TypeError):
+                raise ValueError(f"Invalid pagination cursor {after!r}") from None
+            queryset = queryset._clone(_seek=(field, descending, (pk,) if pk_ordered else (value, pk)))
+
+        rows = queryset[:page_size + 1]._load()  # One more row, telling whether there is a next page.
+        items = rows[:page_size]
+        if len(rows) <= page_size:
+            return Page(items, None)
+        last = items[-1]
+        value = None if pk_ordered else last._column_value(dict(zip(self.model.meta.columns[1:], self.model.meta.fields))[column])
+        return Page(items, urlsafe_b64encode(json.dumps([value, last.pk]).encode()).decode())
 
     def create(self, **kwargs):
         """ Creates an instance of the specified model, saves it to the database, and returns it to the user. """
@@ -144,10 +687,186 @@ class QuerySet:
         instance = self.model(**kwargs)  # Create the instance before we save it.
         instance.save()  # TODO Kevin: Get the primary key from the database when done.
 
+    def bulk_create(self, objs: Iterable['DBModel'], batch_size: int = 1000) -> list['DBModel']:
+        """
+        Inserts the provided unsaved instances using multi-row INSERT statements, committing once per batch.
+        Primary keys are assigned from the first AUTO_INCREMENT value of each batch, which relies on InnoDB
+        allocating consecutive values to a single INSERT (innodb_autoinc_lock_mode = 0 or 1) on MySQL.
+
+        :param objs: Unsaved instances of the queryset's model.
+        :param batch_size: Maximum number of rows per INSERT statement.
+        :return: The provided instances, now with their primary keys set.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
+        objs = list(objs)
+        invalid_obj = next((obj for obj in objs if type(obj) is not self.model or obj.pk is not None), None)
+        if invalid_obj: raise ValueError(f"{invalid_obj} is not an unsaved instance of {self.model}")
+
+        if not objs:
+            return objs
+
+        max_placeholders = self.model.meta.connection.backend.max_placeholders
+        batch_size = min(batch_size, max_placeholders // len(self.model.meta.fields) if self.model.meta.fields else batch_size)
+
+        for shard, shard_objs in self._by_connection(objs).items():  # Each shard inserts its own rows, when sharded.
+            with shard.acquire() as connection:
+                try: connection.consume_results()
+                except Exception: pass
+
+                increment = connection.backend.auto_increment_increment(connection)
+
+                for start in range(0, len(shard_objs), batch_size):
+                    batch = shard_objs[start:start + batch_size]
+                    rows = [obj._column_values() for obj in batch]
+
+                    cursor = instrumentation.execute(connection, compiler.compile_insert(self.model, len(batch)),
+                                                     tuple(value for row in rows for value in row), self)
+                    first_pk = connection.backend.first_insert_id(cursor, len(batch))
+                    connection.commit()
+
+                    for offset, (obj, row) in enumerate(zip(batch, rows)):
+                        obj._pk = first_pk + offset * increment
+                        obj._initial_values = (obj._pk, *row)
+                        obj._dirty = None
+                _invalidate(self.model, connection)
+
+        if (session := current_session()) is not None:
+            for obj in objs:
+                session.add(obj)
+
+        return objs
+
+    def _by_connection(self, objs: list['DBModel']) -> dict[DatabaseConnection | ConnectionPool | ReplicaRouter, list['DBModel']]:
+        """ :return: The instances grouped by the connection their rows are written to; their shard, when the model is sharded. """
+        groups = {}
+        for obj in objs:
+            groups.setdefault(obj._connection(), []).append(obj)
+        return groups
+
+    def _check_shard_key(self, fields: Iterable[str]) -> None:
+        """ Rows are placed on their shard when inserted, such that their shard key can't be changed afterwards. """
+        sharding = self.model.meta.connection
+        if isinstance(sharding, Sharding) and sharding.key in fields:
+            raise ValueError(f"Cannot change the shard key {sharding.key} of {self.model}, delete and recreate the rows instead")
+
+    def _write(self, sql: str, params: tuple[Any, ...], shard: DatabaseConnection | ConnectionPool | ReplicaRouter = None) -> int:
+        """
+        Executes and commits a statement changing rows, and returns the number of affected rows.
+        :param shard: The connection to write to; when omitted, every shard which may hold rows of the queryset, for sharded models.
+        """
+        if shard is None and (shards := self._shards()) is not None:
+            return sum(fan_out(partial(self._write, sql, params), shards))  # Invalidated by the write of each shard.
+
+        with (self.model.meta.connection if shard is None else shard).acquire() as connection:
+            try: connection.consume_results()
+            except Exception: pass
+
+            rowcount = instrumentation.execute(connection, sql, params, self).rowcount
+            connection.commit()
+            _invalidate(self.model, connection)
+        return rowcount
+
+    def update(self, **kwargs) -> int:
+        """
+        Updates every row matched by the queryset with a single statement, without retrieving any rows.
+        Instances already in memory are not updated.
+
+        :param kwargs: Fields paired with their new values, foreign keys may be assigned instances or PKs.
+        :return: The number of rows changed, as reported by the server.
+        """
+        if not kwargs:
+            raise ValueError("No fields specified for QuerySet.update")
+        self._check_unsliced('update')
+        self._check_shard_key(kwargs)
+
+        columns, values = [], []
+        for field, value in kwargs.items():
+            if field not in self.model.meta.fields:
+                raise AttributeError(f"{field} is not a valid field for {self.model}")
+            if isinstance(value, DBModel):
+                if value.pk is None:
+                    raise ValueError(f"Cannot update {field} to the unsaved {value}")
+                value = value.pk
+            columns.append(compiler.resolve_column(self.model, field))
+            values.append(value)
+
+        where, params = self._compile_where()
+        return self._write(compiler.compile_update_where(self.model, tuple(columns), where), (*values, *params))
+
+    def delete(self) -> int:
+        """
+        Deletes every row matched by the queryset with a single statement, without retrieving any rows.
+        :return: The number of rows deleted.
+        """
+        self._check_unsliced('delete')
+        where, params = self._compile_where()
+        return self._write(compiler.compile_delete_where(self.model, where), params)
+
+    def bulk_update(self, objs: Iterable['DBModel'], fields: Iterable[str], batch_size: int = 1000) -> int:
+        """
+        Writes the provided fields of saved instances, with one statement per batch,
+        where every row takes its own values through a CASE on its primary key.
+
+        :param objs: Saved instances of the queryset's model.
+        :param fields: Names of the fields to write.
+        :param batch_size: Maximum number of rows per UPDATE statement.
+        :return: The number of rows changed, as reported by the server.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
+        fields = tuple(fields)
+        if not fields:
+            raise ValueError("No fields specified for QuerySet.bulk_update")
+        invalid_field = next((field for field in fields if field not in self.model.meta.fields), None)
+        if invalid_field: raise AttributeError(f"{invalid_field} is not a valid field for {self.model}")
+        self._check_shard_key(fields)
+
+        objs = list(objs)
+        invalid_obj = next((obj for obj in objs if type(obj) is not self.model or obj.pk is None), None)
+        if invalid_obj: raise ValueError(f"{invalid_obj} is not a saved instance of {self.model}")
+
+        # Every row takes a PK and value per field, and its PK once more for the IN (...) condition.
+        batch_size = min(batch_size, self.model.meta.connection.backend.max_placeholders // (2 * len(fields) + 1))
+
+        rowcount = 0
+        for shard, shard_objs in self._by_connection(objs).items():
+            for start in range(0, len(shard_objs), batch_size):
+                batch = shard_objs[start:start + batch_size]
+                rows = [tuple(obj._column_value(field) for field in fields) for obj in batch]
+                params = tuple(value for position in range(len(fields)) for obj, row in zip(batch, rows) for value in (obj.pk, row[position]))
+
+                rowcount += self._write(compiler.compile_bulk_update(self.model, fields, len(batch)), (*params, *(obj.pk for obj in batch)), shard)
+
+                for obj, row in zip(batch, rows):
+                    obj._mark_saved(fields, row)
+
+        return rowcount
+
     def __str__(self) -> str:
         return f"{self.__class__.__name__} object of {self.model.__name__}"
 
 
+def evaluate_all(*querysets: QuerySet) -> tuple[QuerySet, ...]:
+    """
+    Evaluates independent querysets concurrently, such that waiting for them takes about as long as the slowest query,
+    rather than the sum of them. Every query checks out a connection of its own when the models use a ConnectionPool,
+    while the queries through a single connection take turns; on the calling thread, when it already holds the connection.
+
+        users, groups = evaluate_all(User.objects.filter(name='Alice'), NotSQLGroup.objects.order_by('name'))
+
+    :return: The provided querysets, evaluated.
+    """
+    for queryset in querysets:
+        queryset.prefetch()
+    for queryset in querysets:
+        if queryset._pending is not None:
+            queryset.evaluate()
+    return querysets
+
+
 class ModelField:
     """ Represents metadata for a column in the database, holds its name and other attributes. """
     name: str = None
@@ -168,13 +887,75 @@ Models: dict[str, Type["DBModel"]] = {}
 
 class LazygetterWrapper(property):
     model: 'DBModel'
+    slot: str  # Name of the slot holding either the PK or the instance of the related row.
 
-    def __init__(self, fk_model: 'DBModel', fget: Callable[[Any], Any] | None = ..., fset: Callable[[Any, Any], None] | None = ...,
+    def __init__(self, fk_model: 'DBModel', slot: str, fget: Callable[[Any], Any] | None = ..., fset: Callable[[Any, Any], None] | None = ...,
                  fdel: Callable[[Any], None] | None = ..., doc: str | None = ...) -> None:
         self.model = fk_model
+        self.slot = slot
         super().__init__(fget, fset, fdel, doc)
 
 
+class FieldDescriptor:
+    """ Accessor for a field stored in a slot of its own, which marks the field as changed when assigned, for DBModel.save() """
+    name: str
+
+    __slots__ = ('name', '_get', '_set')
+
+    def __init__(self, name: str, member: Any) -> None:
+        """
+        :param name: Name of the field.
+        :param member: The descriptor of the slot holding the value of the field.
+        """
+        self.name = name
+        self._get = member.__get__
+        self._set = member.__set__
+        super().__init__()
+
+    def __get__(self, instance: 'DBModel | None', owner: type = None) -> Any:
+        if instance is None:
+            return self
+        return self._get(instance, owner)
+
+    def __set__(self, instance: 'DBModel', value: Any) -> None:
+        self._set(instance, value)
+        if instance._dirty is None:
+            instance._dirty = {self.name}
+        else:
+            instance._dirty.add(self.name)
+
+
+class ReverseLazygetterWrapper(property):
+    """ Accessor for the instances of another model, which refer to the current instance through a foreign key. """
+    model: 'DBModel'  # The model holding the foreign key.
+    field: str  # Name of the foreign key field on that model.
+
+    def __init__(self, model: 'DBModel', field: str, fget: Callable[[Any], Any] | None = ...) -> None:
+        self.model = model
+        self.field = field
+        super().__init__(fget)
+
+
+def _row_constructor(model: Type['DBModel'], slots: tuple[str, ...]) -> Callable[[tuple[Any, ...], bool], 'DBModel']:
+    """
+    Generates the function creating instances of the model from selected rows, which assigns every column straight to its slot.
+    Skips __init__ and its validation, so rows must hold exactly the columns of ModelMeta.columns, in that order.
+
+    :param slots: Slots of the fields, in the order they are declared.
+    """
+    targets = ''.join(f"obj.{slot}, " for slot in ('_pk', *slots))
+    source = (f"def from_row(row, snapshot=True):\n"
+              f"    obj = new(model)\n"
+              f"    {targets}= row\n"
+              f"    obj._initial_values = row if snapshot else None\n"
+              f"    obj._dirty = None\n"
+              f"    obj._prefetched = None\n"
+              f"    return obj\n")
+    namespace = {'new': object.__new__, 'model': model}
+    exec(source, namespace)
+    return namespace['from_row']
+
+
 class _DBModelMeta(type):
     """
     Black magic metaclass; which in our case allows us to specify properties,
@@ -188,36 +969,115 @@ class _DBModelMeta(type):
         except NameError:
             return super().__new__(cls, name, bases, dct)
 
-        # Create lazy getters for foreignkey fields
-        for field, value in dct.items():
+        annotations: dict[str, Any] = dct.get('__annotations__', {})
+        options = dct.pop('Meta', None)  # Django'esque model options, such as indexes.
+        fk_fields: dict[str, Type[DBModel]] = {}
+        declared_fields: dict[str, Any] = {}  # Becomes ModelMeta.fields
+        field_slots: dict[str, str] = {}
+        slots: list[str] = []
+        slot_defaults: list[tuple[str, Any]] = []
+
+        # Fields declared by annotations alone are included, with the annotation as their type.
+        for field, value in (annotations | dct).items():
+            if field.startswith('__') or isinstance(value, (FunctionType, classmethod, staticmethod, property)):
+                continue  # Not a field
+
             fk_model: Type[DBModel] = None
             if isclass(value) and issubclass(value, DBModel):
                 fk_model = value
-            elif dct.get('__annotations__', {}).get(field, None) is DBModel and isinstance(value, str):
+            elif annotations.get(field, None) is DBModel and isinstance(value, str):
                 fk_model = Models[value]
             # elif # TODO Kevin: Check for ForeignkeyField here
 
             if fk_model:
-                def lazy_foreignkey_getter(self):
-                    if isinstance(self._fk_cache.get(field, None), int):  # TODO Kevin: Is None the right way to do this?  # This row has not been queried yet
-                        fk_names = foreignkey_relationships[self.meta.table_name][fk_model.meta.table_name + 'ID']
-
-                        # fk_names[1] == name of the PK column on the foreignkey model
-                        # self._fk_cache[field] == currently the PK of the foreignkey instance
-                        self._fk_cache[field] = fk_model.objects.get(**{fk_names[1]: self._fk_cache[field]})
-                    return self._fk_cache.get(field, None)
-
-                def foreignkey_setter(self, val: Any):
+                # The slot holds the PK of the related row, until it is replaced by the instance when first accessed.
+                slot = f"_fk_{field}"
+
+                # Bind the loop variables as defaults, such that every foreign key field keeps its own field and model.
+                def lazy_foreignkey_getter(self, field=field, slot=slot, fk_model=fk_model):
+                    related = getattr(self, slot)
+                    if isinstance(related, int):  # This row has not been queried yet
+                        session = current_session()
+                        if session is None or (instance := session.get(fk_model, related)) is None:
+                            instrumentation.lazy_load(self.model, field)
+                            # Tables created without the foreign key constraint, such as sharded tables, use the conventional names.
+                            fk_names = foreignkey_relationships.get(self.meta.table_name, {}).get(
+                                fk_model.meta.pk_column, (fk_model.meta.table_name, fk_model.meta.pk_column))
+
+                            # fk_names[1] == name of the PK column on the foreignkey model
+                            instance = fk_model.objects.get(**{fk_names[1]: related})
+                        related = instance
+                        setattr(self, slot, related)
+                    return related
+
+                def foreignkey_setter(self, val: Any, field=field, slot=slot):
                     if isinstance(val, DBModel):
-                        self._fk_cache[field] = val.pk
+                        setattr(self, slot, val.pk)
                     elif isinstance(val, (int, NoneType)):
-                        self._fk_cache[field] = val
+                        setattr(self, slot, val)
                     else:
-                        raise TypeError(f"Cannot assign foreign key field from {type(value)}")
-
-                dct[field] = LazygetterWrapper(fk_model, lazy_foreignkey_getter, foreignkey_setter)
-
-        return super().__new__(cls, name, bases, dct)
+                        raise TypeError(f"Cannot assign foreign key field from {type(val)}")
+                    if self._dirty is None:
+                        self._dirty = {field}
+                    else:
+                        self._dirty.add(field)
+
+                dct[field] = declared_fields[field] = LazygetterWrapper(fk_model, slot, lazy_foreignkey_getter, foreignkey_setter)
+                fk_fields[field] = fk_model
+                value = None  # The related row is unassigned.
+
+            else:  # The value is stored in a slot, accessed through a FieldDescriptor which replaces the declaration.
+                slot = f"_f_{field}"
+                dct.pop(field, None)
+                declared_fields[field] = value
+                # Field declarations, and types from annotations alone, leave the value unassigned.
+                value = None if isinstance(value, StringField) or isclass(value) else value
+
+            field_slots[field] = slot
+            slots.append(slot)
+            slot_defaults.append((slot, value))
+
+        # Indexes declared by the Meta class, followed by those of the fields themselves.
+        indexes = [index if isinstance(index, Index) else Index((index,) if isinstance(index, str) else tuple(index))
+                   for index in getattr(options, 'indexes', ())]
+        indexes += (Index(tuple(fields), unique=True) for fields in getattr(options, 'unique_together', ()))
+        indexes += (Index((field,), unique=value.unique) for field, value in declared_fields.items()
+                    if isinstance(value, StringField) and (value.index or value.unique))
+        for index in indexes:
+            invalid_field = next((field for field in index.fields if field not in declared_fields), None)
+            if invalid_field: raise AttributeError(f"Cannot index {invalid_field}, which is not a field of {name}")
+        # An index declared both ways is created once, keeping the first declaration, such as one named by the Meta class.
+        deduplicated = {}
+        for index in indexes:
+            deduplicated.setdefault((index.fields, index.unique), index)
+
+        dct['__slots__'] = tuple(slots)
+        dct['_declared_fields'] = declared_fields
+        dct['_indexes'] = tuple(deduplicated.values())
+        dct['_field_slots'] = field_slots
+        dct['_slot_defaults'] = tuple(slot_defaults)
+
+        new_cls = super().__new__(cls, name, bases, dct)
+        new_cls._from_row = staticmethod(_row_constructor(new_cls, dct['__slots__']))
+        for field, slot in field_slots.items():
+            if field not in fk_fields:
+                setattr(new_cls, field, FieldDescriptor(field, vars(new_cls)[slot]))
+
+        # Give the referenced models Django'esque reverse accessors, such as NotSQLGroup.user_set
+        for field, fk_model in fk_fields.items():
+            reverse_name = f"{name.lower()}_set"
+
+            def reverse_getter(self, reverse_name=reverse_name, model=new_cls) -> QuerySet:
+                related = model.objects.filter(**{self.meta.pk_column: self.pk})
+                if self._prefetched is not None and reverse_name in self._prefetched:  # Filled by prefetch_related()
+                    related._result = self._prefetched[reverse_name]
+                elif self.pk is None:  # Nothing may refer to an unsaved instance.
+                    related._result = ()
+                return related
+
+            setattr(fk_model, reverse_name, ReverseLazygetterWrapper(new_cls, field, reverse_getter))
+
+        return new_cls
 
     def __init__(cls, name: str, bases: tuple, dct: dict) -> None:
         try:
@@ -241,21 +1101,42 @@ class ModelMeta(NamedTuple):
     table_name: str
     database_name: str
     fields: dict[str, Any]
-    connection: ConnectionSingleton = None
+    connection: DatabaseConnection | ConnectionPool | ReplicaRouter | Sharding = None
+    statements: dict[tuple, str] = None  # Statements compiled by resources.compiler, cached per kind and field set.
+    indexes: tuple[Index, ...] = ()  # Secondary indexes created by create_tables()
+
+    @property
+    def columns(self) -> tuple[str, ...]:
+        """ :return: Names of the columns of the table, in the order they are selected; starting with the primary key. """
+        return self.pk_column, *(fieldtype.model.meta.pk_column if isinstance(fieldtype, LazygetterWrapper) else fieldname
+                                 for fieldname, fieldtype in self.fields.items())
 
     def __str__(self) -> str:
         return f"Meta for {self.table_name}"
 
 
 class DBModel(metaclass=_DBModelMeta):
-    """ Django'esque model class which converts table rows to Python class instances. """
+    """
+    Django'esque model class which converts table rows to Python class instances.
+    The metaclass gives every model __slots__ for its fields, such that instances carry no __dict__.
+    """
 
-    model = None
-    # values: dict[str, Any] = None  # Holds the values of the instances.
-    _initial_values: dict[str, Any] = None  # Holds the initial values for comparison when saving.
-    _fk_cache: dict[str, int]  # TODO Kevin: Put PKs in this when querying
     meta: ModelMeta = None  # Class variable describing the model
-    _pk: int = None  # Contains the actual PK  # TODO Kevin: Would prefer if this was not hardcoded to an int.
+    _declared_fields: dict[str, Any] = {}  # Fields declared on the model class, set by the metaclass.
+    _field_slots: dict[str, str] = {}  # Maps the fields to the slots holding their values, set by the metaclass.
+    _indexes: tuple[Index, ...] = ()  # Declared indexes, set by the metaclass.
+    _slot_defaults: tuple[tuple[str, Any], ...] = ()  # Initial value of every field slot, set by the metaclass.
+    # Creates an instance from a selected row, generated by the metaclass. Optionally keeping the row as its initial values.
+    _from_row: Callable[[tuple[Any, ...], bool], 'DBModel']
+
+    _pk: int  # Contains the actual PK  # TODO Kevin: Would prefer if this was not hardcoded to an int.
+    # The row as it was selected, in the order of ModelMeta.columns; for comparison when saving.
+    # None for new instances, and instances of QuerySet.readonly()
+    _initial_values: tuple[Any, ...] | None
+    _dirty: set[str] | None  # Fields assigned since the instance was created or last saved.
+    _prefetched: dict[str, tuple['DBModel', ...]] | None  # Reverse relations loaded by prefetch_related()
+
+    __slots__ = ('_pk', '_initial_values', '_dirty', '_prefetched', '__weakref__')  # Weak references for Session
 
     def __init__(self, *args, zipped_data: zip = None, **kwargs) -> None:
         """
@@ -269,86 +1150,147 @@ class DBModel(metaclass=_DBModelMeta):
         if type(self) is DBModel:  # NOTE Abstraction: This exception prevents creation of instances of the base class.
             raise AbstractInstantiationError("Cannot instantiate instances of DBModel itself, use subclasses instead.")
 
-        # Allow a more readable way to access the class itself from its instances.
-        self.model: Type[DBModel] = self.__class__
-
-        self._fk_cache = {}
+        self._pk = None
+        self._initial_values = None
+        self._dirty = None
+        self._prefetched = None
+        for slot, default in self._slot_defaults:
+            setattr(self, slot, default)
 
         # We allow several different ways to pass data to the constructor of the model instance
         if kwargs:
-            invalid_field = next((field for field in kwargs.keys() if field not in {metafield.name for metafield in self.Meta.fields}), None)
+            invalid_field = next((field for field in kwargs.keys() if field not in self._declared_fields), None)
             if invalid_field: raise AttributeError(f"{invalid_field} is not a valid field for {self.model}")
-            self._initial_values = kwargs
-
-            for field, value in kwargs.items():
-                setattr(self, field, value)
-
+            data = kwargs.items()
         else:
-            # Zip the data correctly, such that we pair column names with their values.
-            data = zipped_data or zip(self.meta.fields.keys(), args) or {field: None for field in self.meta.fields.keys()}
-            # Convert the result to a dictionary.
-            datadict = {fieldname: value for fieldname, value in data}
-
-            # Take care that we don't set invalid fields for the instance.
-            invalid_fields = set(datadict.keys()).difference(set(self.meta.fields.keys()))
-            if invalid_fields: raise AttributeError(f"{invalid_fields} are not valid fields for {self.model}")
+            # Zip the data correctly, such that we pair field names with their values.
+            data = zipped_data or zip(self._declared_fields.keys(), args)
 
-            for field, value in datadict.items():
-                setattr(self, field, value)
-
-            # Merge the values into the class.
-            self._initial_values = datadict
-
-        # We run these assignments sequentially,
-        # to ensure that the primary key is removed from the dictionary, before it is copied.
-        #self._initial_values = copy(values)
+        for field, value in data:
+            if field not in self._declared_fields:  # Take care that we don't set invalid fields for the instance.
+                raise AttributeError(f"{field} is not a valid field for {self.model}")
+            setattr(self, field, value)
 
         super().__init__()
 
+    @property
+    def model(self) -> Type['DBModel']:
+        """ Allow a more readable way to access the class itself from its instances. """
+        return type(self)
+
     @property
     def pk(self) -> int:
         """ Returns the value of the current instance's primary key. """
         return self._pk
 
-    def save(self) -> None:  # TODO Kevin: Test save.
-        """ Saves or updates the current instance in the database. """
-        # raise NotImplementedError("Save method is currently not finished.")
-        cursor = self.meta.connection.cursor
-
-        def _sql_value_formatter(fieldname: str) -> str:
-            print(str(getattr(self, fieldname)))
-            if isinstance(self.meta.fields[fieldname], LazygetterWrapper):
-                instance = getattr(self, fieldname)
-                if instance is not None:  # Foreign keys must be saved  # TODO Kevin: Don't like to do this here
-                    instance.save()
-                    return str(instance.pk)
-                else:
-                    return 'null'
-            elif isinstance(self.meta.fields[fieldname], (StringField, str)):  # TODO Kevin: The type tuple should probably be handled differently.
-                return f"'{getattr(self, fieldname)}'"
-            return str(getattr(self, fieldname))
+    def save(self, update_fields: Iterable[str] = None) -> None:
+        """
+        Saves or updates the current instance in the database.
+        Existing rows are only updated for the fields assigned since they were loaded or last saved,
+        and are not written at all when no such field has changed.
 
+        :param update_fields: Write only these fields of an existing row, whether they were assigned or not.
+        """
         if self.pk:  # Update existing row
-            # TODO Kevin: Runtime reflection here; please fix next patch. Also just terrible
-            diff = {fieldname: val for fieldname in self.meta.fields.keys() if (val := getattr(self, fieldname)) != self._initial_values[fieldname]}
-            values = str(tuple(f"{column} = |||{value}|||" for column, value in diff.items()))[1:-2].replace(r"'",'').replace('|||', r"'")
-            cursor.execute(f"UPDATE {self.meta.table_name} SET {values} WHERE {self.meta.pk_column} = {self.pk}")
-            self.meta.connection.connection.commit()
-        else:  # Insert new row
-            # TODO Kevin: Runtime reflection here; please fix next patch. Also just terrible
-            valdict = {fieldtype.model.meta.pk_column if isinstance(fieldtype, LazygetterWrapper) else fieldname: _sql_value_formatter(fieldname) for fieldname, fieldtype in self.meta.fields.items()}
-            # TODO Kevin: LOCK TABLE '{self.meta.table_name}'
-            cursor.execute(f"INSERT INTO {self.meta.table_name}({', '.join(valdict.keys())}) VALUES ({', '.join(valdict.values())})")
-            self.meta.connection.connection.commit()
+            if update_fields is not None:
+                fields = tuple(update_fields)
+                invalid_field = next((field for field in fields if field not in self._field_slots), None)
+                if invalid_field: raise AttributeError(f"{invalid_field} is not a valid field for {self.model}")
+            elif self._dirty:
+                # Keep the declaration order, such that the same fields always compile to the same statement.
+                # Fields assigned the value they already had are skipped, when there is a snapshot to compare against.
+                fields = tuple(field for column, field in enumerate(self._field_slots, 1) if field in self._dirty and
+                               (self._initial_values is None or self._column_value(field) != self._initial_values[column]))
+            else:
+                return
+
+            if fields:
+                self.model.objects._check_shard_key(fields)
+                values = tuple(self._column_value(field) for field in fields)
+                with self._connection().acquire() as connection:
+                    instrumentation.execute(connection, compiler.compile_update(self.model, fields), (*values, self.pk), self)
+                    connection.commit()
+                    _invalidate(self.model, connection)
+                self._mark_saved(fields, values)
+
+            if update_fields is None:  # The remaining assigned fields were unchanged.
+                self._dirty = None
 
-            # Get our PK
-            cursor.execute(f"SELECT MAX({self.meta.pk_column}) FROM {self.meta.table_name}")
-            # TODO Kevin: UNLOCK TABLES
-            self._pk = next(cursor)[0]
+        else:  # Insert new row
+            values = self._column_values()
+            with self._connection().acquire() as connection:
+                cursor = instrumentation.execute(connection, compiler.compile_insert(self.model), values, self)
+                # The AUTO_INCREMENT value of our own insert, unaffected by concurrent writers (unlike SELECT MAX()).
+                self._pk = cursor.lastrowid
+                connection.commit()
+                _invalidate(self.model, connection)
+            self._initial_values = (self._pk, *values)
+            self._dirty = None
+            if (session := current_session()) is not None:
+                session.add(self)
+
+    def _mark_saved(self, fields: tuple[str, ...], values: tuple[Any, ...]) -> None:
+        """ Keeps the snapshot in line with the row after writing the values of the fields, which are no longer dirty. """
+        if self._initial_values is not None:
+            written = dict(zip(fields, values))
+            self._initial_values = (self.pk, *(written[field] if field in written else initial
+                                               for field, initial in zip(self._field_slots, self._initial_values[1:])))
+        if self._dirty is not None:
+            self._dirty.difference_update(fields)
+            if not self._dirty:
+                self._dirty = None
+
+    def _connection(self) -> DatabaseConnection | ConnectionPool | ReplicaRouter:
+        """ :return: The connection the row of the instance is written to; the shard it is placed on, when the model is sharded. """
+        sharding = self.meta.connection
+        if not isinstance(sharding, Sharding):
+            return sharding
+        shard = sharding.place(self) if self.pk is None else sharding.shard_of_pk(self.pk)
+        if shard is None:
+            raise ValueError(f"No shard of {self.model} holds the primary key of {self}")
+        return sharding.shards[shard]
+
+    def _column_value(self, fieldname: str) -> Any:
+        """ :return: The value to write for the column of the field; the PK of the related row for foreign keys. """
+        # Read the slot directly, so we don't query the related row.
+        value = getattr(self, self._field_slots[fieldname])
+        if isinstance(value, DBModel):
+            if value.pk is None:
+                raise ValueError(f"Cannot save {self} before its related {value.model.__name__} ({fieldname}) is saved.")
+            value = value.pk
+        return value
+
+    def _column_values(self) -> tuple[Any, ...]:
+        """ :return: The values to write for the non-PK columns of the instance, in the order of ModelMeta.columns. """
+        return tuple(self._column_value(fieldname) for fieldname in self._field_slots)
+
+    async def asave(self) -> None:
+        """ Counterpart of save(), for use in asyncio event loops. """
+        await run_in_executor(self.save)
+
+    async def adelete(self) -> None:
+        """ Counterpart of delete(), for use in asyncio event loops. """
+        await run_in_executor(self.delete)
+
+    async def arelated(self, field: str) -> 'DBModel | None':
+        """
+        Awaitable counterpart of reading a foreign key field, which may query the related row.
+        :param field: Name of the foreign key field.
+        """
+        accessor = getattr(self.model, field, None)
+        if not isinstance(accessor, LazygetterWrapper):
+            raise AttributeError(f"{field} is not a foreign key field for {self.model}")
+        if isinstance(related := getattr(self, accessor.slot), int):  # Only query when the row is not already loaded.
+            return await run_in_executor(getattr, self, field)
+        return related
 
     def delete(self):
-        self.meta.connection.cursor.execute(f"DELETE FROM {self.meta.table_name} WHERE {self.meta.pk_column} = {self.pk}")
-        self.meta.connection.connection.commit()
+        with self._connection().acquire() as connection:
+            instrumentation.execute(connection, compiler.compile_delete(self.model), (self.pk,), self)
+            connection.commit()
+            _invalidate(self.model, connection)
+        if (session := current_session()) is not None:
+            session.discard(self)
         self._pk = None  # TODO Kevin: Would break for multiple object for the same row.
 
     def __str__(self) -> str:
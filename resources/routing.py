@@ -0,0 +1,114 @@
+"""
+Read/write splitting, spreading the reads of the ORM over replicas of the primary database.
+
+    router = ReplicaRouter(primary_pool, [(replica_pool, 2), (other_replica_pool, 1)])
+    connect_orm(router, 'myqueryorm')
+
+    User.objects.filter(name='Alice')  # Read from a replica, picked by their weights.
+    User.objects.using_primary().get(pk=1)  # Read from the primary, regardless.
+
+    with sticky():  # Such as per web request.
+        user.save()  # Written to the primary, like every other write.
+        User.objects.get(pk=user.pk)  # Read from the primary as well, as the block has written.
+
+Reads within atomic() blocks always go to the primary, such that transactions see their own writes.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run routing.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run routing.py instead of app.py. This, sadly, will not work :(")
+
+from random import choices
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator
+from resources.backends import Backend
+from resources.transaction import in_atomic
+from resources.utils import DatabaseConnection, ConnectionPool
+
+
+class _StickyScope:
+    """ Whether a sticky() block has written through a router, after which its reads go to the primary. """
+
+    __slots__ = ['written']
+
+    def __init__(self) -> None:
+        self.written = False
+
+
+_sticky: ContextVar[_StickyScope | None] = ContextVar('sticky', default=None)
+
+
+@contextmanager
+def sticky() -> Iterator[None]:
+    """
+    Reads go to the primary once the block has written, such that it reads its own writes despite replication lag.
+    Applies to the current thread or asyncio task, nested blocks share the scope of the outermost block.
+    """
+    if _sticky.get() is not None:
+        yield
+        return
+
+    token = _sticky.set(_StickyScope())
+    try:
+        yield
+    finally:
+        _sticky.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Used in place of a connection or pool, sending writes to the primary and reads to the replicas.
+    The ORM acquires connections through acquire() for writes, and acquire_read() for the reads of querysets.
+    """
+
+    primary: DatabaseConnection | ConnectionPool
+    replicas: tuple[DatabaseConnection | ConnectionPool, ...]
+    weights: tuple[float, ...]
+
+    def __init__(self, primary: DatabaseConnection | ConnectionPool,
+                 replicas: Iterable[DatabaseConnection | ConnectionPool | tuple[DatabaseConnection | ConnectionPool, float]]) -> None:
+        """
+        :param primary: Connection, or pool of connections, to the primary database.
+        :param replicas: Connections, or pools, to the replicas; optionally paired with their weight, which defaults to 1.
+            Reads go to the primary when there are none.
+        """
+        pairs = [replica if isinstance(replica, tuple) else (replica, 1) for replica in replicas]
+        if any(weight <= 0 for _, weight in pairs):
+            raise ValueError("The weights of replicas must be positive")
+
+        self.primary = primary
+        self.replicas = tuple(replica for replica, _ in pairs)
+        self.weights = tuple(weight for _, weight in pairs)
+        super().__init__()
+
+    @property
+    def backend(self) -> Backend:
+        return self.primary.backend
+
+    @contextmanager
+    def acquire(self, exclusive: bool = False) -> Iterator[DatabaseConnection]:
+        """ Acquires a connection to the primary, for writing. """
+        if (scope := _sticky.get()) is not None:
+            scope.written = True
+        with self.primary.acquire(exclusive) as connection:
+            yield connection
+
+    def acquire_read(self, exclusive: bool = False) -> Iterator[DatabaseConnection]:
+        """ Acquires a connection for reading; to a replica, unless the reads of the current context must see its writes. """
+        return self.read_connection().acquire(exclusive)
+
+    def read_connection(self) -> DatabaseConnection | ConnectionPool:
+        """ :return: The connection, or pool, the next read of the current context goes to. """
+        if not self.replicas or self.reads_primary():
+            return self.primary
+        return choices(self.replicas, self.weights)[0]
+
+    @staticmethod
+    def reads_primary() -> bool:
+        """ :return: Whether the reads of the current context must see its writes, and go to the primary. """
+        return in_atomic() or ((scope := _sticky.get()) is not None and scope.written)
+
+    def close(self) -> None:
+        for connection in (self.primary, *self.replicas):
+            connection.close()
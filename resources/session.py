@@ -0,0 +1,84 @@
+"""
+Opt-in identity map, which keeps a single instance per row for as long as it is in use.
+Within a session, querysets and foreign keys return the instance already in memory for a row,
+and foreign keys are resolved without querying the database at all when it is found.
+
+    with Session():
+        users = list(User.objects)  # Users of the same group now share one NotSQLGroup instance.
+
+The session is bound to the current context, such that it only applies to the thread or asyncio task which entered it;
+the coroutines of resources.aio share the session of the task awaiting them.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run session.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run session.py instead of app.py. This, sadly, will not work :(")
+
+from contextvars import ContextVar, Token
+from weakref import WeakValueDictionary
+from typing import Any, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from resources.orm import DBModel
+
+_current: ContextVar['Session | None'] = ContextVar('session', default=None)
+
+
+def current_session() -> 'Session | None':
+    """ :return: The session of the current context, if any. """
+    return _current.get()
+
+
+class Session:
+    """
+    Maps (table name, PK) to the instance of the row; only weakly, such that instances no longer used are still freed.
+    Use as a context manager, sessions may be nested and entered again.
+    """
+
+    _instances: WeakValueDictionary[tuple[str, Any], 'DBModel']
+    _tokens: list[Token]
+
+    def __init__(self) -> None:
+        self._instances = WeakValueDictionary()
+        self._tokens = []
+        super().__init__()
+
+    def __enter__(self) -> 'Session':
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        _current.reset(self._tokens.pop())
+
+    def get(self, model: Type['DBModel'], pk: Any) -> 'DBModel | None':
+        """ :return: The instance of the row, if it is in the session. """
+        return self._instances.get((model.meta.table_name, pk), None)
+
+    def add(self, instance: 'DBModel') -> 'DBModel':
+        """
+        Adds a saved instance to the session, unless another instance of its row is already there.
+        :return: The instance of the row in the session.
+        """
+        return self._instances.setdefault((instance.meta.table_name, instance.pk), instance)
+
+    def load(self, model: Type['DBModel'], row: tuple[Any, ...], snapshot: bool = True) -> 'DBModel':
+        """ Counterpart of DBModel._from_row(), which returns the instance already in the session for the row, when there is one. """
+        instance = self._instances.get((model.meta.table_name, row[0]), None)
+        if instance is None:
+            instance = self.add(model._from_row(row, snapshot))
+        return instance
+
+    def discard(self, instance: 'DBModel') -> None:
+        """ Removes the instance from the session, such as when its row is deleted. """
+        key = (instance.meta.table_name, instance.pk)
+        if self._instances.get(key, None) is instance:
+            del self._instances[key]
+
+    def clear(self) -> None:
+        self._instances.clear()
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+    def __contains__(self, instance: 'DBModel') -> bool:
+        return self._instances.get((instance.meta.table_name, instance.pk), None) is instance
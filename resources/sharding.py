@@ -0,0 +1,232 @@
+"""
+Horizontal sharding, splitting the rows of a model over several databases by a shard key.
+
+    shards = {User: HashSharding('group', [shard_a, shard_b])}  # Connections, pools or ReplicaRouters.
+    create_tables(connection, 'myqueryorm', shards=shards)
+    connect_orm(connection, 'myqueryorm', shards=shards)
+
+    User.objects.get(pk=7)  # Queries the one shard holding the row.
+    User.objects.filter(group=group)  # Queries the one shard holding the rows of the group.
+    User.objects.filter(name='Alice').order_by('name')  # Queries every shard concurrently, merging their ordered rows.
+
+New rows are placed on the shard of their shard key. Every shard hands out primary keys from a range of its own,
+which create_tables() starts the AUTO_INCREMENT of the table at; such that primary keys are unique across shards,
+and each row is found on a single shard by its primary key.
+Rows of several shards are merged by order_by() in Python, ordering strings the way the default collation of the
+backend does; columns with another collation may be merged in a different order than a single database would sort them.
+Sharded tables have no foreign key constraints, and can't be joined by select_related(), as the related rows may be
+stored elsewhere. Transactions, such as atomic(using=shard), span a single shard.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run sharding.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run sharding.py instead of app.py. This, sadly, will not work :(")
+
+import heapq
+from zlib import crc32
+from bisect import bisect_right
+from itertools import chain, count
+from functools import cmp_to_key
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Type, TypeVar, TYPE_CHECKING
+from resources import compiler, orm
+from resources.backends import Backend
+from resources.transaction import in_atomic
+from resources.utils import DatabaseConnection, ConnectionPool
+
+if TYPE_CHECKING:
+    from resources.routing import ReplicaRouter
+
+T = TypeVar('T')
+
+# Primary keys are signed int columns.
+MAX_ID = 2 ** 31 - 1
+
+# Worker threads querying shards concurrently, shared by every sharded model.
+FAN_OUT_WORKERS = 16
+
+_executor: ThreadPoolExecutor = None
+
+
+class Sharding:
+    """
+    Base class of the strategies placing rows on shards, used in place of the connection of a sharded model.
+    The shard key is either 'pk', or the name of a field; foreign keys are placed by the primary key of the related row.
+    """
+
+    key: str
+    shards: tuple['DatabaseConnection | ConnectionPool | ReplicaRouter', ...]
+    id_span: int  # Number of primary keys handed out by each shard.
+
+    def __init__(self, key: str, shards: Iterable['DatabaseConnection | ConnectionPool | ReplicaRouter'], id_span: int = None) -> None:
+        """
+        :param key: 'pk', or the name of the field placing rows on shards.
+        :param shards: Connections, or pools, to the shards. Their order must never change, as it places the rows.
+        :param id_span: Number of primary keys handed out by each shard, shard n starting at n * id_span + 1.
+            Defaults to splitting the range of int columns between the shards.
+        """
+        self.key = key
+        self.shards = tuple(shards)
+        if not self.shards:
+            raise ValueError("Sharding needs at least one shard")
+        self.id_span = MAX_ID // len(self.shards) if id_span is None else id_span
+        if self.id_span < 1 or self.id_span * len(self.shards) > MAX_ID:
+            raise ValueError(f"The primary keys of {len(self.shards)} shards of {self.id_span} keys don't fit in an int column")
+        super().__init__()
+
+    @property
+    def backend(self) -> Backend:
+        return self.shards[0].backend
+
+    def acquire(self, exclusive: bool = False):
+        raise TypeError("Sharded models have no single connection, such as for atomic(); use one of their shards instead")
+
+    def first_id(self, shard: int) -> int:
+        """ :return: The first primary key handed out by the shard. """
+        return shard * self.id_span + 1
+
+    def shard_of_pk(self, pk: int) -> int | None:
+        """ :return: The shard holding the row with the primary key, None when no shard hands out such keys. """
+        shard = (pk - 1) // self.id_span
+        return shard if 0 <= shard < len(self.shards) else None
+
+    def shard_of_key(self, value: Any) -> int:
+        """ :return: The shard placing rows with this value of the shard key. """
+        raise NotImplementedError
+
+    def place(self, instance: 'orm.DBModel') -> int:
+        """ :return: The shard to insert the unsaved instance into. """
+        return self.shard_of_key(instance._column_value(self.key))
+
+    def shards_for(self, model: Type['orm.DBModel'], condition: 'orm.Q | None') -> tuple['DatabaseConnection | ConnectionPool | ReplicaRouter', ...]:
+        """ :return: The shards which may hold rows matching the condition of a queryset. """
+        shards = self._pinned(model, condition)
+        return self.shards if shards is None else tuple(self.shards[shard] for shard in sorted(shards))
+
+    def _pinned(self, model: Type['orm.DBModel'], condition: 'orm.Q | None') -> set[int] | None:
+        """ :return: The shards the condition limits rows to, None when rows of any shard may match. """
+        if condition is None or condition.negated:
+            return None
+
+        pinned = [self._pinned(model, child) if isinstance(child, orm.Q) else self._pinned_lookup(model, *child)
+                  for child in condition.children]
+        if condition.connector == orm.Q.OR:  # Rows of any of the pinned shards, unless a child may match on any shard.
+            return None if None in pinned else set().union(*pinned)
+        pinned = [shards for shards in pinned if shards is not None]  # Rows of the pinned shards of every child.
+        return set.intersection(*pinned) if pinned else None
+
+    def _pinned_lookup(self, model: Type['orm.DBModel'], key: str, value: Any) -> set[int] | None:
+        column, lookup = compiler.resolve_lookup(model, key)
+        if lookup not in ('exact', 'in'):
+            return None
+        values = value if lookup == 'in' else (value,)
+        values = [value.pk if isinstance(value, orm.DBModel) else value for value in values]
+
+        if column == model.meta.pk_column:
+            return {shard for value in values if value is not None and (shard := self.shard_of_pk(value)) is not None}
+        if self.key != 'pk' and column == compiler.resolve_column(model, self.key):
+            return {self.shard_of_key(value) for value in values}
+        return None
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.key!r}, {len(self.shards)} shards)"
+
+
+class HashSharding(Sharding):
+    """
+    Spreads rows evenly over the shards by the hash of their shard key.
+    With 'pk' as the shard key, new rows are spread over the shards in turn, as their primary key is handed out by the shard.
+    """
+
+    def __init__(self, key: str, shards: Iterable['DatabaseConnection | ConnectionPool | ReplicaRouter'], id_span: int = None) -> None:
+        super().__init__(key, shards, id_span)
+        self._turn = count()
+
+    def shard_of_key(self, value: Any) -> int:
+        if value is None:
+            return 0
+        if isinstance(value, int):
+            return value % len(self.shards)
+        # Python's own hash() of strings changes between processes.
+        return crc32(str(value).encode()) % len(self.shards)
+
+    def place(self, instance: 'orm.DBModel') -> int:
+        if self.key == 'pk':
+            return next(self._turn) % len(self.shards)
+        return super().place(instance)
+
+
+class RangeSharding(Sharding):
+    """ Places rows on shards by ranges of their shard key, such as by date or region. """
+
+    bounds: tuple[Any, ...]
+
+    def __init__(self, key: str, bounds: Iterable[Any], shards: Iterable['DatabaseConnection | ConnectionPool | ReplicaRouter'],
+                 id_span: int = None) -> None:
+        """
+        :param bounds: The lowest key of every shard but the first, in ascending order.
+            Keys below the first bound are placed on the first shard, NULL keys included.
+        """
+        if key == 'pk':
+            raise ValueError("Rows can't be placed by ranges of their primary key, which is handed out by the shard; use HashSharding('pk', ...)")
+        super().__init__(key, shards, id_span)
+        self.bounds = tuple(bounds)
+        if len(self.bounds) != len(self.shards) - 1:
+            raise ValueError(f"{len(self.shards)} shards need {len(self.shards) - 1} bounds")
+        if list(self.bounds) != sorted(self.bounds):
+            raise ValueError("The bounds must be in ascending order")
+
+    def shard_of_key(self, value: Any) -> int:
+        return 0 if value is None else bisect_right(self.bounds, value)
+
+
+def fan_out(func: Callable[[Any], T], shards: Iterable[Any]) -> list[T]:
+    """
+    :return: The results of calling func with every shard, called concurrently on worker threads in a copy of the caller's context.
+        Within atomic() blocks the shards are called in turn by the calling thread instead, which holds the connection of the transaction.
+    """
+    global _executor
+    shards = tuple(shards)
+    if len(shards) == 1 or in_atomic():
+        return [func(shard) for shard in shards]
+    if _executor is None:
+        _executor = ThreadPoolExecutor(FAN_OUT_WORKERS, thread_name_prefix='MyQueryORM-shard')
+    futures = [_executor.submit(copy_context().run, func, shard) for shard in shards]
+    return [future.result() for future in futures]
+
+
+def _compare(left: Any, right: Any, key: Callable[[Any], Any] | None) -> int:
+    """ Compares column values the way the database orders them ascending, NULL first. """
+    if left is None or right is None:
+        return (left is not None) - (right is not None)
+    if key is not None:
+        left, right = key(left), key(right)
+    if left == right:
+        return 0
+    return -1 if left < right else 1
+
+
+def merge(results: Iterable[Iterable[tuple[Any, ...]]], order: tuple[tuple[int, bool], ...] = (),
+          key: Callable[[Any], Any] = None) -> Iterator[tuple[Any, ...]]:
+    """
+    Merges the rows of every shard, lazily such that rows may be streamed.
+    :param order: (index, descending) of the columns the rows of each shard are ordered by, which the merged rows keep.
+        The rows of the shards simply follow each other without.
+    :param key: Orders the column values the way the database does, such as Backend.sort_key() of the shards.
+        Python's own ordering of the values is used without.
+    """
+    if not order:
+        return chain.from_iterable(results)
+
+    def compare(left: tuple[Any, ...], right: tuple[Any, ...]) -> int:
+        for index, descending in order:
+            if result := _compare(left[index], right[index], key):
+                return -result if descending else result
+        return 0
+
+    return heapq.merge(*results, key=cmp_to_key(compare))
@@ -0,0 +1,111 @@
+"""
+Transactions spanning several ORM operations, which are committed (or rolled back) as a whole.
+
+    with atomic():
+        for user in users:
+            user.save()  # Committed once, when the block is done.
+
+Nested atomic() blocks use savepoints, such that an exception only rolls back the innermost block it leaves.
+"""
+
+if __name__ == '__main__':
+    # Gently remind the user to not run transaction.py themselves
+    raise SystemExit("Hiya (ʘ‿ʘ)╯, it appears you're trying to run transaction.py instead of app.py. This, sadly, will not work :(")
+
+from contextvars import ContextVar
+from contextlib import contextmanager, ExitStack
+from typing import Iterator, Type
+from resources import orm
+from resources.cache import get_cache
+from resources.utils import DatabaseConnection, ConnectionPool, bind, bound
+
+# The tables written by the outermost atomic() block of the current context, None outside of atomic() blocks.
+_tables: ContextVar[set[str] | None] = ContextVar('tables', default=None)
+
+
+def in_atomic() -> bool:
+    """ :return: Whether the current thread, or asyncio task, is within an atomic() block. """
+    return _tables.get() is not None
+
+
+def defer_invalidation(table: str) -> None:
+    """ Invalidates the cached results of the table once the outermost atomic() block commits, rather than before. """
+    _tables.get().add(table)
+
+
+def _resolve(using: 'Type[orm.DBModel] | DatabaseConnection | ConnectionPool | None') -> DatabaseConnection | ConnectionPool:
+    if isinstance(using, type):  # A model
+        return using.meta.connection
+    if using is not None:  # A connection, pool or resources.routing.ReplicaRouter
+        return using
+
+    connections = {id(model.meta.connection): model.meta.connection for model in orm.Models.values() if model.meta is not None}
+    if len(connections) != 1:
+        raise ValueError("atomic() must be told which connection to use, when the models are not connected to exactly one")
+    return next(iter(connections.values()))
+
+
+@contextmanager
+def atomic(using: 'Type[orm.DBModel] | DatabaseConnection | ConnectionPool' = None) -> Iterator[DatabaseConnection]:
+    """
+    Runs the block in a transaction, which is committed when the block is done, or rolled back when it raises.
+    The ORM doesn't commit its writes within the block. Also usable as a decorator, as @atomic()
+
+    The block applies to the current thread, or asyncio task, and to the worker threads running in copies of its context;
+    such as those of resources.aio, whose asave() and the like write within the transaction.
+    Its connection is bound to the block, other threads sharing a single connection wait for the block to finish,
+    while a ConnectionPool keeps the connection checked out for the block.
+    Instances saved within a block that is rolled back keep the state of the write, such as the primary key of an insert.
+
+    :param using: The connection, or model whose connection, to run the transaction on.
+        Defaults to the connection shared by every model.
+    """
+    source = _resolve(using)
+    with ExitStack() as stack:
+        if (connection := bound(source)) is None:
+            connection = stack.enter_context(source.acquire())
+            # A resources.routing.ReplicaRouter writes through its primary.
+            stack.enter_context(bind(connection, source, getattr(source, 'primary', source)))
+
+        with source.acquire():
+            depth = connection.atomic_depth
+            savepoint = f"atomic_{depth}"
+
+            if depth == 0:
+                try: connection.consume_results()
+                except Exception: pass
+                if connection.in_transaction:  # End the snapshot of earlier reads.
+                    connection.connection.commit()
+                connection.begin()
+            else:
+                connection.cursor.execute(f"SAVEPOINT {savepoint}")
+            connection.atomic_depth += 1
+
+        token = _tables.set(set()) if depth == 0 else None
+        committed = False
+        try:
+            yield connection
+            with source.acquire():
+                if depth == 0:
+                    connection.connection.commit()
+                else:
+                    connection.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+            committed = True
+        finally:
+            with source.acquire():  # Takes turns with worker threads still using the connection.
+                connection.atomic_depth -= 1
+                try:
+                    if not committed:
+                        try: connection.consume_results()
+                        except Exception: pass
+                        if depth == 0:
+                            connection.connection.rollback()
+                        else:
+                            connection.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                finally:
+                    if token is not None:
+                        tables = _tables.get()
+                        _tables.reset(token)
+                        if committed and (cache := get_cache()) is not None:
+                            for table in tables:
+                                cache.invalidate(table)
@@ -1,5 +1,61 @@
+from time import monotonic
+from threading import Condition, RLock, local
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from mysql.connector import MySQLConnection
 from mysql.connector.cursor import CursorBase
+from typing import Callable, Iterator, NamedTuple
+from resources.exceptions import PoolTimeoutError
+from resources.backends import Backend, MYSQL, backend_for
+
+# Connections bound to the current context by resources.transaction.atomic(), by the id of the connection or pool they were acquired from.
+_bound: ContextVar[dict[int, '_Binding']] = ContextVar('bound', default={})
+
+
+class _Binding:
+    """ Connection of an atomic() block, which the threads running in its context take turns using. """
+
+    __slots__ = ('connection', 'lock', 'active')
+
+    def __init__(self, connection: 'DatabaseConnection') -> None:
+        self.connection = connection
+        self.lock = RLock()
+        self.active = True  # Worker threads may outlive the block, after which they acquire connections as usual.
+
+
+@contextmanager
+def bind(connection: 'DatabaseConnection', *sources: 'DatabaseConnection | ConnectionPool') -> Iterator[None]:
+    """
+    Binds the connection to the current context for the duration of the block, such that acquiring from the sources
+    within the context returns the connection; also on worker threads running in copies of the context, like those of resources.aio
+    """
+    binding = _Binding(connection)
+    token = _bound.set({**_bound.get(), **{id(source): binding for source in sources}})
+    try:
+        yield
+    finally:
+        with binding.lock:  # Waits for the worker threads using the connection.
+            binding.active = False
+        _bound.reset(token)
+
+
+def bound(source: 'DatabaseConnection | ConnectionPool') -> 'DatabaseConnection | None':
+    """ :return: The connection bound to the current context for the source, if any. """
+    binding = _bound.get().get(id(source), None)
+    return binding.connection if binding is not None and binding.active else None
+
+
+@contextmanager
+def _acquire_bound(source: 'DatabaseConnection | ConnectionPool') -> Iterator['DatabaseConnection | None']:
+    """ Acquires the connection bound to the current context for the source, None when there is none. """
+    binding = _bound.get().get(id(source), None)
+    if binding is not None:
+        with binding.lock:
+            if binding.active:
+                yield binding.connection
+                return
+    yield None
 
 
 class _SingletonMeta(type):
@@ -11,15 +67,273 @@ class _SingletonMeta(type):
         return cls._instance[cls]
 
 
-class ConnectionSingleton(metaclass=_SingletonMeta):
+class DatabaseConnection:
+    """ A single connection to the database, with its cursor and prepared statements. """
 
     connection: MySQLConnection
     cursor: CursorBase
-    # commit = True  # Used to allow QuerySet to commit multiple rows
+    backend: Backend
+    prepared_statements: OrderedDict[str, tuple[str, CursorBase]]  # Maps statements to their prepared cursor.
+    atomic_depth: int  # Number of nested resources.transaction.atomic() blocks running on the connection.
+    # QuerySet.iterator() is streaming a result, which other statements can't be interleaved with by the backend.
+    streaming: bool
 
-    __slots__ = ['connection', 'cursor']
+    __slots__ = ['connection', 'cursor', 'backend', 'prepared_statements', 'atomic_depth', 'streaming', '_lock']
 
-    def __init__(self, connection: MySQLConnection, cursor: CursorBase) -> None:
+    def __init__(self, connection: MySQLConnection, cursor: CursorBase = None, backend: Backend = None) -> None:
+        """ :param backend: Backend of the connection, picked from the type of the connection by default. """
         self.connection = connection
-        self.cursor = cursor
+        self.cursor = connection.cursor() if cursor is None else cursor
+        self.backend = backend_for(connection) if backend is None else backend
+        self.prepared_statements = OrderedDict()
+        self.atomic_depth = 0
+        self.streaming = False
+        self._lock = RLock()
+        super().__init__()
+
+    @contextmanager
+    def acquire(self, exclusive: bool = False) -> Iterator['DatabaseConnection']:
+        """
+        Counterpart of ConnectionPool.acquire(), threads sharing this connection take turns using it.
+        Within an atomic() block, the threads of its context take turns among themselves, while other threads wait for the block.
+        :param exclusive: Has no effect, as there is no other connection to hand out.
+        """
+        with _acquire_bound(self) as connection:
+            if connection is not None:
+                yield connection
+                return
+        with self._lock:
+            yield self
+
+    def held(self) -> bool:
+        """ :return: Whether the current thread has acquired the connection, which other threads wait for. """
+        return self._lock._is_owned()
+
+    def execute(self, sql: str, params: tuple = ()) -> CursorBase:
+        """
+        Executes a parameterized statement, as a server-side prepared statement on MySQL.
+        Any result must be fetched before the next statement is executed.
+
+        :param sql: Statement using %s placeholders, preferably compiled by resources.compiler.
+        :param params: Values for the placeholders.
+        :return: The cursor holding the result of the statement.
+        """
+        if self.streaming:
+            raise RuntimeError("Cannot run other statements on a connection while QuerySet.iterator() streams a result over it; "
+                               "use a ConnectionPool, or select_related() to load foreign keys")
+        return self.backend.execute(self, sql, params)
+
+    def commit(self) -> None:
+        """ Commits the current transaction, unless within an atomic() block, which commits once it is done. """
+        if not self.atomic_depth:
+            self.connection.commit()
+
+    def consume_results(self) -> None:
+        """ Reads any result left unread, such that the connection may run the next statement. """
+        if not self.streaming:  # Left for the iterator, rather than cut short; execute() raises instead.
+            self.backend.consume_results(self.connection)
+
+    def begin(self) -> None:
+        """ Starts a transaction, which lasts until it is committed or rolled back. """
+        self.backend.begin(self.connection)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.backend.in_transaction(self.connection)
+
+    def is_connected(self) -> bool:
+        return self.backend.is_connected(self.connection)
+
+    def server_info(self) -> str:
+        return self.backend.server_info(self.connection)
+
+    def close(self) -> None:
+        self.backend.close(self)
+
+
+class ConnectionSingleton(DatabaseConnection, metaclass=_SingletonMeta):
+    """ The one connection shared by the entire process, suitable for single threaded scripts. """
+
+    __slots__ = []
+
+
+class PoolStats(NamedTuple):
+    """ Snapshot of the usage of a ConnectionPool. """
+    size: int  # Maximum number of connections.
+    open: int  # Connections currently opened by the pool.
+    idle: int  # Open connections not checked out by any thread.
+    checkouts: int  # Total number of checkouts, not counting nested acquires.
+    waits: int  # Checkouts that had to wait for another thread to return a connection.
+    wait_time: float  # Total seconds spent waiting.
+    timeouts: int  # Checkouts that gave up waiting, raising PoolTimeoutError.
+    health_check_failures: int  # Idle connections found dead on checkout, and replaced.
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of database connections, which may be used in place of the ConnectionSingleton.
+    Every thread checks out its own connection with acquire(), which the ORM does around each of its operations.
+    Threads may also hold a connection for a longer scope, such as a web request, by wrapping it in acquire().
+    """
+
+    size: int
+    timeout: float
+    health_check_after: float
+    backend: Backend
+
+    def __init__(self, connect: Callable[[], MySQLConnection], size: int = 5, timeout: float = 30.0,
+                 health_check_after: float = 1.0, backend: Backend = MYSQL) -> None:
+        """
+        :param connect: Opens a new connection to the database, such as functools.partial(connector.connect, ...)
+        :param size: Maximum number of connections opened at once.
+        :param timeout: Seconds to wait for a connection to be returned, when all are checked out.
+        :param health_check_after: Connections idle for at least this many seconds are pinged on checkout,
+            and replaced if dead. 0 pings on every checkout.
+        :param backend: Backend of the connections opened by connect.
+        """
+        if size < 1:
+            raise ValueError("The pool size must be a positive integer")
+
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.backend = backend
+
+        self._idle: list[tuple[DatabaseConnection, float]] = []  # Connections paired with when they were returned.
+        self._open = 0
+        self._closed = False
+        self._condition = Condition()
+        self._local = local()
+
+        self._checkouts = self._waits = self._timeouts = self._health_check_failures = 0
+        self._wait_time = 0.0
         super().__init__()
+
+    @contextmanager
+    def acquire(self, exclusive: bool = False) -> Iterator[DatabaseConnection]:
+        """
+        Checks out a connection for the current thread, for the duration of the with block.
+        Nested acquires within the same thread reuse the connection already checked out,
+        as do the threads of the context of an atomic() block; such as the workers of resources.aio
+
+        :param exclusive: Check out a connection which isn't reused by nested acquires,
+            such as for streaming a result while the thread keeps querying.
+            Within an atomic() block the connection of its transaction is used regardless, which alone sees its writes.
+        """
+        with _acquire_bound(self) as connection:
+            if connection is not None:
+                yield connection
+                return
+
+        if exclusive:
+            connection = self._checkout()
+            try:
+                yield connection
+            finally:
+                self._checkin(connection)
+            return
+
+        current: DatabaseConnection = getattr(self._local, 'connection', None)
+        if current is not None:
+            yield current
+            return
+
+        connection = self._checkout()
+        self._local.connection = connection
+        try:
+            yield connection
+        finally:
+            self._local.connection = None
+            self._checkin(connection)
+
+    def _checkout(self) -> DatabaseConnection:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot check out connections from a closed pool")
+            self._checkouts += 1
+            if not self._idle and self._open >= self.size:
+                self._waits += 1
+                started = monotonic()
+                try:
+                    while not self._idle and self._open >= self.size:
+                        if self._closed:
+                            raise RuntimeError("Cannot check out connections from a closed pool")
+                        remaining = self.timeout - (monotonic() - started)
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeoutError(f"No connection was returned to the pool within {self.timeout} seconds")
+                        self._condition.wait(remaining)
+                finally:
+                    self._wait_time += monotonic() - started
+
+            if self._idle:
+                connection, returned = self._idle.pop()  # The most recently used connection is the least likely to be stale.
+            else:
+                connection, returned = None, None
+                self._open += 1  # Reserve the slot, before opening the connection outside the lock.
+
+        if connection is not None and monotonic() - returned >= self.health_check_after:
+            if not self._is_healthy(connection):
+                with self._condition:
+                    self._health_check_failures += 1
+                try: connection.close()
+                except Exception: pass
+                connection = None
+
+        if connection is None:
+            try:
+                connection = DatabaseConnection(self._connect(), backend=self.backend)
+            except BaseException:
+                with self._condition:
+                    self._open -= 1
+                    self._condition.notify()
+                raise
+
+        return connection
+
+    @staticmethod
+    def _is_healthy(connection: DatabaseConnection) -> bool:
+        try:
+            return connection.is_connected()  # Pings the server.
+        except Exception:
+            return False
+
+    def _checkin(self, connection: DatabaseConnection) -> None:
+        try:  # Don't leak unread results or an open transaction (and its stale snapshot) to the next thread.
+            connection.consume_results()
+            if connection.in_transaction:
+                connection.connection.rollback()
+        except Exception:  # The connection is broken, and will be replaced on the next checkout.
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            try: connection.close()
+            except Exception: pass
+            return
+
+        with self._condition:
+            if not self._closed:
+                self._idle.append((connection, monotonic()))
+                self._condition.notify()
+                return
+            self._open -= 1
+
+        try: connection.close()
+        except Exception: pass
+
+    def stats(self) -> PoolStats:
+        with self._condition:
+            return PoolStats(self.size, self._open, len(self._idle), self._checkouts, self._waits,
+                             self._wait_time, self._timeouts, self._health_check_failures)
+
+    def close(self) -> None:
+        """ Closes every idle connection, connections still checked out are closed when returned. """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._closed = True
+            self._condition.notify_all()  # Wake up the threads waiting for a connection, such that they may fail.
+        for connection, _ in idle:
+            try: connection.close()
+            except Exception: pass
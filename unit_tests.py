@@ -2,37 +2,61 @@
 Run this module to perform the preconfigured unit tests for MyQueryHouse.
 """
 
-import docker
+import sys
+import json
+import sqlite3
+import asyncio
 import unittest
 from time import sleep
 from typing import Type
 from os.path import join
+from tempfile import TemporaryDirectory
 
-from resources.modelfields import StringField
-from resources.orm import DBModel
+from resources.modelfields import StringField, Index
+from resources import compiler
+from resources.orm import DBModel, Q, Models, evaluate_all
 from mysql.connector import connect
 from resources.init import create_tables
 from mockmodels import User, NotSQLGroup
 from subprocess import call, DEVNULL, run
 from mysql.connector import MySQLConnection
-from docker.errors import NotFound, APIError
 from mysql.connector.cursor import CursorBase
-from docker.models.containers import Container
-from resources.utils import ConnectionSingleton
-from test_resources.utils import TempDockerContainer
+from threading import Thread
+from resources.init import connect_orm, foreignkey_relationships
+from resources.utils import ConnectionSingleton, ConnectionPool, DatabaseConnection
+from resources.session import Session, current_session
+from resources.cache import QueryCache, MemoryCache, set_cache
+from resources.transaction import atomic
+from resources.routing import ReplicaRouter, sticky
+from resources.sharding import HashSharding, merge
+from resources.backends import MYSQL, SQLITE
+from resources import instrumentation
 from test_resources.test_subclass import MoreTestCases
-from resources.exceptions import AbstractInstantiationError
+from resources.exceptions import AbstractInstantiationError, NPlusOneWarning
+
+try:
+    import docker
+    from docker.errors import NotFound, APIError
+    from docker.models.containers import Container
+    from test_resources.utils import TempDockerContainer
+except ImportError:  # Only needed by the tests against MySQL, which are skipped without it.
+    docker = None
 
 
 DATABASE_NAME = 'MyQueryORM_Mock'
+CONTAINER_NAME = DATABASE_NAME + '_test_db'
+PASSWORD = "Test1234!"
+PORT = 53063
 
 
 class TestOrm(MoreTestCases):
     connection_singleton: ConnectionSingleton
-    container: Container
+    container: 'Container'
 
     def setUp(self):
         """ Instantiates a MySQL Docker container mock database, to run unit tests against. """
+        if docker is None:
+            self.skipTest("docker is not installed")
 
         # TODO Kevin: Some refactoring may be in order here. Destruction of unit test resources raises ResourceWarning;
         #   stating: unclosed socket. This may hint at needed changes to an __exit__ method somewhere.
@@ -40,10 +64,6 @@ class TestOrm(MoreTestCases):
         client = docker.from_env()
         client.images.pull('mysql')  # Ensure that the image is pulled.
 
-        CONTAINER_NAME = DATABASE_NAME + '_test_db'
-        PASSWORD = "Test1234!"
-        PORT = 53063
-
         try:  # Attempt to retrieve an existing testing container.
             container = client.containers.get(CONTAINER_NAME)
         except NotFound:  # Create one for our use case.
@@ -60,12 +80,7 @@ class TestOrm(MoreTestCases):
             print(f"Waiting for container with name: '{container.name}' to start.")
             sleep(15)
 
-        connection = connect(
-            host='127.0.0.1',
-            user='root',
-            port=PORT,
-            password=PASSWORD,
-        )
+        connection = self.connect()
         cursor = connection.cursor()
         cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DATABASE_NAME}")
 
@@ -73,11 +88,23 @@ class TestOrm(MoreTestCases):
         self.connection_singleton = ConnectionSingleton(connection, cursor)
 
         create_tables(self.connection_singleton, DATABASE_NAME)
+        connect_orm(self.connection_singleton, DATABASE_NAME)
+
+    def connect(self) -> MySQLConnection:
+        """ :return: A new connection to the database server of the tests. """
+        return connect(host='127.0.0.1', user='root', port=PORT, password=PASSWORD)
+
+    def connect_shard(self, shard: int) -> MySQLConnection:
+        """ :return: A new connection to a database server of its own, for the shard. """
+        self.skipTest("The shards need database servers of their own")
+
+    def _disconnect(self) -> None:
+        self.connection_singleton.close()
+        ConnectionSingleton._instance.pop(ConnectionSingleton, None)  # Let the next test create a new singleton.
 
     def tearDown(self) -> None:
         """ Stop and delete created Docker container. """
-        self.connection_singleton.cursor.close()
-        self.connection_singleton.connection.close()
+        self._disconnect()
         try:
             self.container.stop()
             self.container.remove()
@@ -100,6 +127,745 @@ class TestOrm(MoreTestCases):
             db_user = User.objects.get(name='Trololo')  # Check that we can query the user we created.
             self.assertEqual(db_user.name, 'Trololo')  # Check that the name is applied correctly.
 
+    def test_select_related(self):
+        """ Check that select_related() fills the foreign key cache, such that reading the field doesn't query again. """
+
+        # Setup phase
+        cursor = self.connection_singleton.cursor
+        cursor.execute(f"INSERT INTO {compiler.table(NotSQLGroup)}(name) VALUES ('Admins')")
+        cursor.execute(f"INSERT INTO {compiler.table(User)}(name, NotSQLGroupID) VALUES ('Grouped', {cursor.lastrowid})")
+        cursor.execute(f"INSERT INTO {compiler.table(User)}(name, NotSQLGroupID) VALUES ('Groupless', NULL)")
+        self.connection_singleton.connection.commit()
+
+        users = {user.name: user for user in User.objects.select_related('group')}
+        self.assertIsInstance(users['Grouped']._fk_group, NotSQLGroup)  # Already loaded, not just the PK.
+        self.assertEqual(users['Grouped'].group.name, 'Admins')
+        self.assertIsNone(users['Groupless'].group)
+
+        with self.assertRaises(AttributeError):
+            User.objects.select_related('name')  # Not a foreign key.
+
+    def test_prefetch_related(self):
+        """ Check that prefetch_related() loads both forward and reverse relations into the foreign key cache. """
+
+        # Setup phase
+        cursor = self.connection_singleton.cursor
+        cursor.execute(f"INSERT INTO {compiler.table(NotSQLGroup)}(name) VALUES ('Admins')")
+        cursor.execute(f"INSERT INTO {compiler.table(User)}(name, NotSQLGroupID) VALUES ('First', {cursor.lastrowid})")
+        cursor.execute(f"INSERT INTO {compiler.table(User)}(name, NotSQLGroupID) VALUES ('Second', 1)")
+        self.connection_singleton.connection.commit()
+
+        users = User.objects.prefetch_related('group')
+        self.assertTrue(all(isinstance(user._fk_group, NotSQLGroup) for user in users))
+
+        group = NotSQLGroup.objects.prefetch_related('user_set')[0]
+        self.assertEqual({user.name for user in group.user_set}, {'First', 'Second'})
+        self.assertTrue(all(user.group is group for user in group.user_set))  # Children point back to the same instance.
+
+    def test_bulk_create(self):
+        """ Check that bulk_create() inserts every instance, and assigns the primary keys of their rows. """
+
+        # Setup phase
+        users = []
+        for i in range(5):
+            user = User()
+            user.name = f"Bulk{i}"
+            users.append(user)
+
+        User.objects.bulk_create(users, batch_size=2)
+
+        self.assertEqual(len({user.pk for user in users}), 5)
+        for user in users:
+            self.assertEqual(User.objects.get(UserID=user.pk).name, user.name)
+
+    def test_parameterized_statements(self):
+        """ Check that values are passed as parameters, and that compiled statements are reused. """
+
+        # Setup phase
+        user = User()
+        user.name = "O'Neil'; DROP TABLE User; --"
+        user.save()
+
+        with self.assertNotRaises(LookupError):
+            db_user = User.objects.get(name="O'Neil'; DROP TABLE User; --")
+            self.assertEqual(db_user.pk, user.pk)
+
+        # The very same string is returned, such that the prepared statement is reused.
+        self.assertIs(compiler.compile_update(User, ('name',)), compiler.compile_update(User, ('name',)))
+
+        # Threads sharing a full cache drop statements concurrently.
+        max_cached, compiler.MAX_CACHED_STATEMENTS = compiler.MAX_CACHED_STATEMENTS, 4
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Switch threads as often as possible.
+        errors = []
+
+        def _compile(offset: int):
+            try:
+                for i in range(2000):
+                    compiler.compile_update(User, ('name',) * ((i + offset) % 12 + 1))
+            except Exception as e:
+                errors.append(e)
+
+        try:
+            threads = [Thread(target=_compile, args=(i,)) for i in range(8)]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+        finally:
+            compiler.MAX_CACHED_STATEMENTS = max_cached
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(User.meta.statements), 4)
+
+    def test_connection_pool(self):
+        """ Check that threads may use the ORM concurrently through a ConnectionPool. """
+
+        # Setup phase
+        pool = ConnectionPool(self.connect, size=2, backend=self.connection_singleton.backend)
+        connect_orm(pool, DATABASE_NAME)
+
+        def _create_users(prefix: str):
+            for i in range(10):
+                user = User()
+                user.name = f"{prefix}{i}"
+                user.save()
+
+        threads = [Thread(target=_create_users, args=(f"Thread{i}_",)) for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        self.assertEqual(len(User.objects), 40)
+
+        stats = pool.stats()
+        self.assertLessEqual(stats.open, 2)  # Never more connections than the size of the pool.
+        self.assertEqual(stats.idle, stats.open)  # Every connection has been returned.
+        pool.close()
+
+    def test_slicing(self):
+        """ Check that slicing an unevaluated queryset selects only the rows of the slice. """
+
+        # Setup phase
+        users = User.objects.bulk_create(User(name=f"User{i}") for i in range(10))
+
+        with instrumentation.collect() as log:
+            sliced = User.objects.order_by('pk')[2:5]
+            self.assertEqual([user.pk for user in sliced], [user.pk for user in users[2:5]])
+            self.assertEqual([user.pk for user in User.objects.order_by('pk')[2:5][1:]], [user.pk for user in users[3:5]])
+            self.assertEqual(User.objects.order_by('-pk')[0].pk, users[-1].pk)
+        self.assertEqual(log.count, 3)
+        self.assertTrue(all(event.rowcount <= 3 for event in log.queries))
+
+        self.assertEqual(User.objects[8:].count(), 2)
+        self.assertFalse(User.objects[10:].exists())
+        with self.assertRaises(IndexError):
+            User.objects[10]
+        with self.assertRaises(TypeError):
+            User.objects[:5].filter(name='User1')
+
+    def test_paginate_by(self):
+        """ Check that keyset pagination returns every row once, in order, page by page. """
+
+        # Setup phase
+        User.objects.bulk_create(User(name=f"User{i % 3}") for i in range(7))
+        expected = [user.pk for user in User.objects.order_by('-name', '-pk')]
+
+        pages, cursor = [], None
+        while True:
+            page = User.objects.paginate_by('-name', 3, after=cursor)
+            pages.append([user.pk for user in page.items])
+            if (cursor := page.next_cursor) is None:
+                break
+
+        self.assertEqual(pages, [expected[0:3], expected[3:6], expected[6:]])
+        self.assertIsNone(User.objects.paginate_by('pk', 7).next_cursor)
+
+        # Rows with a NULL field are left out of every page, rather than cutting the pages short.
+        group = NotSQLGroup(name='Paged')
+        group.save()
+        User.objects.filter(name='User1').update(group=group)
+        grouped = [user.pk for user in User.objects.filter(group=group).order_by('pk')]
+        page = User.objects.paginate_by('group', 1)
+        self.assertEqual([user.pk for user in page.items], grouped[:1])
+        self.assertEqual([user.pk for user in User.objects.paginate_by('group', 5, after=page.next_cursor).items], grouped[1:])
+        with self.assertRaises(ValueError):
+            User.objects.paginate_by('name', 3, after='invalid')
+
+    def test_evaluate_all(self):
+        """ Check that evaluate_all() and prefetch() evaluate querysets concurrently, on connections of their own. """
+
+        # Setup phase
+        pool = ConnectionPool(self.connect, size=2, backend=self.connection_singleton.backend)
+        connect_orm(pool, DATABASE_NAME)
+
+        try:
+            group = NotSQLGroup(name='Group')
+            group.save()
+            User.objects.bulk_create(User(name=f"User{i}", group=group) for i in range(5))
+
+            users, groups = evaluate_all(User.objects.order_by('-name'), NotSQLGroup.objects)
+            self.assertEqual([user.name for user in users._result], [f"User{i}" for i in reversed(range(5))])
+            self.assertEqual([related.pk for related in groups._result], [group.pk])
+
+            users = User.objects.filter(name='User1').prefetch()
+            self.assertIsNotNone(users._pending)  # Running on a worker thread.
+            self.assertEqual(users.count(), 1)
+            self.assertEqual(users[0].name, 'User1')
+
+            with atomic(using=pool):
+                User(name='Uncommitted').save()
+                uncommitted, = evaluate_all(User.objects.filter(name='Uncommitted'))
+                self.assertEqual(len(uncommitted), 1)  # Read within the transaction.
+        finally:
+            connect_orm(self.connection_singleton, DATABASE_NAME)
+            pool.close()
+
+    def test_evaluate_all_held_connection(self):
+        """ Check that evaluate_all() runs on the calling thread, when it holds the single connection of the models. """
+
+        # Setup phase
+        User.objects.bulk_create(User(name=f"User{i}") for i in range(3))
+        counts = []
+
+        def _evaluate():
+            with self.connection_singleton.acquire():
+                counts.append(len(evaluate_all(NotSQLGroup.objects)[0]))
+            if self.connection_singleton.backend.interleaved_results:  # Queries nested in iterator()
+                for _ in User.objects.iterator(chunk_size=1):
+                    counts.append(len(evaluate_all(NotSQLGroup.objects)[0]))
+
+        thread = Thread(target=_evaluate, daemon=True)  # Fails rather than hangs when deadlocked.
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(counts, [0] * (4 if self.connection_singleton.backend.interleaved_results else 1))
+
+    def test_async(self):
+        """ Check that the ORM may be awaited from an asyncio event loop. """
+
+        async def _scenario():
+            group = NotSQLGroup()
+            group.name = 'AsyncGroup'
+            await group.asave()
+
+            user = User()
+            user.name = 'AsyncUser'
+            user.group = group
+            await user.asave()
+
+            db_user = await User.objects.aget(name='AsyncUser')
+            self.assertEqual((await db_user.arelated('group')).name, 'AsyncGroup')
+            self.assertEqual([user.name async for user in User.objects], ['AsyncUser'])
+
+            await db_user.adelete()
+            self.assertEqual(len(await User.objects.afilter(name='AsyncUser')), 0)
+
+        asyncio.run(_scenario())
+
+    def test_async_atomic(self):
+        """ Check that awaited writes within atomic() run in its transaction, on a single connection as well as a pool. """
+
+        async def _scenario():
+            with atomic():
+                await asyncio.wait_for(User(name='Committed').asave(), 10)
+            self.assertTrue(User.objects.filter(name='Committed').exists())
+
+            pool = ConnectionPool(self.connect, size=2, backend=self.connection_singleton.backend)
+            connect_orm(pool, DATABASE_NAME)
+            try:
+                with self.assertRaises(KeyError):
+                    with atomic(using=pool):
+                        await asyncio.wait_for(User(name='RolledBack').asave(), 10)
+                        raise KeyError
+                self.assertFalse(User.objects.filter(name='RolledBack').exists())
+            finally:
+                connect_orm(self.connection_singleton, DATABASE_NAME)
+                pool.close()
+
+        asyncio.run(_scenario())
+
+    def test_atomic_iterator(self):
+        """ Check that iterator() within atomic() streams from the connection of the transaction, seeing its writes. """
+
+        # Setup phase
+        pool = ConnectionPool(self.connect, size=2, backend=self.connection_singleton.backend)
+        router = ReplicaRouter(pool, [])
+        try:
+            for using in (pool, router):
+                connect_orm(using, DATABASE_NAME)
+                with self.assertRaises(KeyError):
+                    with atomic(using=using):
+                        User(name='Uncommitted').save()
+                        self.assertEqual([user.name for user in User.objects.iterator()], ['Uncommitted'])
+                        raise KeyError
+        finally:
+            connect_orm(self.connection_singleton, DATABASE_NAME)
+            pool.close()
+
+    def test_iterator(self):
+        """ Check that iterator() streams every row, without caching the instances on the queryset. """
+
+        # Setup phase
+        users = []
+        for i in range(25):
+            user = User()
+            user.name = f"Streamed{i}"
+            users.append(user)
+        User.objects.bulk_create(users)
+
+        queryset = User.objects.select_related('group')
+        self.assertEqual([user.name for user in queryset.iterator(chunk_size=10)], [user.name for user in users])
+        self.assertIsNone(queryset._result)
+
+        # Abandoning the iteration must leave the connection usable.
+        iterator = User.objects.iterator(chunk_size=4)
+        next(iterator)
+        iterator.close()
+        self.assertEqual(len(User.objects), 25)
+
+    def test_iterator_nested_queries(self):
+        """ Check that queries within iterator() over a single connection either run, or raise, but never cut the iteration short. """
+
+        # Setup phase
+        group = NotSQLGroup(name='Group')
+        group.save()
+        User.objects.bulk_create(User(name=f"Streamed{i}", group=group) for i in range(5))
+
+        def _iterate() -> list[str]:
+            return [user.group.name for user in User.objects.iterator(chunk_size=2)]
+
+        if self.connection_singleton.backend.interleaved_results:
+            self.assertEqual(_iterate(), ['Group'] * 5)
+        else:
+            with self.assertRaises(RuntimeError):
+                _iterate()
+        self.assertEqual(len(User.objects), 5)  # The connection is usable afterwards.
+
+        # A pool streams over a connection of its own, leaving the connection of the thread free.
+        pool = ConnectionPool(self.connect, size=2, backend=self.connection_singleton.backend)
+        connect_orm(pool, DATABASE_NAME)
+        try:
+            self.assertEqual(_iterate(), ['Group'] * 5)
+        finally:
+            connect_orm(self.connection_singleton, DATABASE_NAME)
+            pool.close()
+
+    def test_lazy_queryset(self):
+        """ Check that chained querysets are immutable, and combine their conditions into a single query. """
+
+        # Setup phase
+        for name in ('Alice', 'Bob', 'Carol', 'Dave'):
+            user = User()
+            user.name = name
+            user.save()
+
+        everyone = User.objects.order_by('-name')
+        some = everyone.filter(Q(name='Alice') | Q(name__in=('Bob', 'Carol'))).exclude(name='Bob')
+
+        self.assertIsNone(some._result)  # Nothing is queried before it's needed.
+        self.assertEqual([user.name for user in some], ['Carol', 'Alice'])
+        self.assertEqual([user.name for user in everyone], ['Dave', 'Carol', 'Bob', 'Alice'])  # Unaffected by filter().
+
+        self.assertEqual(some.count(), 2)
+        self.assertTrue(everyone.filter(name='Dave').exists())
+        self.assertFalse(everyone.filter(name='Eve').exists())
+
+        with self.assertRaises(AttributeError):
+            User.objects.filter(not_a_field=1)
+
+    def test_values(self):
+        """ Check that values() and values_list() return the selected fields, rather than model instances. """
+
+        # Setup phase
+        for name in ('Alice', 'Bob'):
+            user = User()
+            user.name = name
+            user.save()
+
+        users = User.objects.order_by('name')
+        self.assertEqual(list(users.values('name')), [{'name': 'Alice'}, {'name': 'Bob'}])
+        self.assertEqual(list(users.values_list('name', 'group')), [('Alice', None), ('Bob', None)])
+        self.assertEqual(list(users.values_list('name', flat=True)), ['Alice', 'Bob'])
+        self.assertEqual(users.values_list('pk', 'name', named=True)[1].name, 'Bob')
+
+        with self.assertRaises(TypeError):
+            users.values_list('pk', 'name', flat=True)
+
+    def test_slots(self):
+        """ Check that instances store their fields in slots, and that read-only instances still save every field. """
+
+        # Setup phase
+        user = User(name='Alice')
+        user.save()
+
+        self.assertFalse(hasattr(user, '__dict__'))
+        with self.assertRaises(AttributeError):
+            user.nickname = 'Ally'
+
+        loaded = User.objects.get(pk=user.pk)
+        self.assertEqual(loaded._initial_values, (user.pk, 'Alice', None))
+
+        readonly = User.objects.readonly().get(pk=user.pk)
+        self.assertIsNone(readonly._initial_values)
+        readonly.name = 'Bob'
+        readonly.save()
+        self.assertEqual(User.objects.get(pk=user.pk).name, 'Bob')
+
+    def test_row_constructor(self):
+        """ Check that instances created straight from rows match those of the regular constructor. """
+        group = NotSQLGroup(name='Admins')
+        group.save()
+
+        user = User._from_row((7, 'Alice', group.pk))
+        self.assertEqual((user.pk, user.name, user.group.pk), (7, 'Alice', group.pk))
+        self.assertEqual(user._initial_values, (7, 'Alice', group.pk))
+        self.assertIsNone(User._from_row((7, 'Alice', None), False)._initial_values)
+
+        with self.assertRaises(ValueError):  # Rows must hold exactly the columns of the model.
+            User._from_row((7, 'Alice'))
+
+    def test_dirty_tracking(self):
+        """ Check that save() only writes assigned fields, and nothing at all when they are unchanged. """
+
+        # Setup phase
+        group = NotSQLGroup(name='Admins')
+        group.save()
+        user = User(name='Alice')
+        user.save()
+
+        user.name = 'Alice'
+        self.assertEqual(user._dirty, {'name'})
+        user.save()  # Assigned the value it already had, so there is nothing to write.
+        self.assertIsNone(user._dirty)
+
+        user.name = 'Bob'
+        user.group = group
+        user.save(update_fields=['name'])
+        self.assertEqual(user._dirty, {'group'})
+        self.assertEqual(user._initial_values, (user.pk, 'Bob', None))
+        self.assertIsNone(User.objects.get(pk=user.pk).group)
+
+        user.save()
+        self.assertEqual(User.objects.get(pk=user.pk).group.pk, group.pk)
+
+        with self.assertRaises(AttributeError):
+            user.save(update_fields=['nickname'])
+
+    def test_set_based_writes(self):
+        """ Check that QuerySet.update(), delete() and bulk_update() change every matched row at once. """
+
+        # Setup phase
+        group = NotSQLGroup(name='Admins')
+        group.save()
+        User.objects.bulk_create(User(name=name) for name in ('Alice', 'Bob', 'Carol'))
+
+        self.assertEqual(User.objects.filter(name__in=('Alice', 'Bob')).update(group=group), 2)
+        self.assertEqual(User.objects.filter(group=group).count(), 2)
+
+        users = list(User.objects.order_by('pk'))
+        for user in users:
+            user.name = user.name.upper()
+        User.objects.bulk_update(users, ['name'], batch_size=2)
+        self.assertEqual(list(User.objects.order_by('pk').values_list('name', flat=True)), ['ALICE', 'BOB', 'CAROL'])
+        self.assertIsNone(users[0]._dirty)
+
+        self.assertEqual(User.objects.filter(group__isnull=True).delete(), 1)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_session(self):
+        """ Check that a session keeps one instance per row, and resolves foreign keys without querying them. """
+
+        # Setup phase
+        group = NotSQLGroup(name='Admins')
+        group.save()
+        User.objects.bulk_create(User(name=name, group=group) for name in ('Alice', 'Bob'))
+
+        alice, bob = User.objects.order_by('name')
+        self.assertIsNot(alice.group, bob.group)  # Without a session, every row gets its own instance.
+
+        with Session() as session:
+            alice, bob = User.objects.order_by('name')
+            self.assertIs(User.objects.get(name='Alice'), alice)
+            self.assertIs(alice.group, bob.group)
+            self.assertIn(alice.group, session)
+
+            bob.delete()
+            self.assertNotIn(bob, session)
+
+        self.assertIsNone(current_session())
+
+    def test_session_prefetch_related(self):
+        """ Check that reverse relations are prefetched for children already in the session, holding their parent instance. """
+
+        # Setup phase
+        group = NotSQLGroup(name='Admins')
+        group.save()
+        User.objects.bulk_create(User(name=name, group=group) for name in ('Alice', 'Bob'))
+
+        with Session():
+            alice, bob = User.objects.order_by('name')
+            alice.group, bob.group  # The children now hold the instance of their group.
+
+            prefetched, = NotSQLGroup.objects.prefetch_related('user_set')
+            self.assertIs(prefetched, alice.group)
+            self.assertEqual(sorted(user.name for user in prefetched.user_set), ['Alice', 'Bob'])
+            self.assertIs(next(user for user in prefetched.user_set if user.name == 'Alice'), alice)
+
+    def test_result_cache(self):
+        """ Check that cached results are reused, and dropped when their table is written. """
+
+        # Setup phase
+        user = User(name='Alice')
+        user.save()
+        cache = QueryCache(MemoryCache(max_entries=2), ttl={User: 60})
+        set_cache(cache)
+
+        try:
+            self.assertEqual(User.objects.filter(name='Alice').count(), 1)
+            self.assertEqual(User.objects.filter(name='Alice').count(), 1)
+            self.assertEqual(cache.stats()[:2], (1, 1))  # One hit, one miss.
+
+            user.name = 'Bob'
+            user.save()  # Invalidates the cached count.
+            self.assertEqual(User.objects.filter(name='Alice').count(), 0)
+
+            for pk in range(3):
+                User.objects.filter(pk=pk).exists()
+            self.assertEqual(cache.stats().entries, 2)
+
+            # Writes committed on another connection within atomic() are invalidated at once, even when it rolls back.
+            pool = ConnectionPool(self.connect, size=1, backend=self.connection_singleton.backend)
+            User.meta = User.meta._replace(connection=pool)
+            try:
+                self.assertEqual(User.objects.filter(name='Committed').count(), 0)
+                with self.assertRaises(KeyError):
+                    with atomic(using=NotSQLGroup):
+                        User(name='Committed').save()
+                        raise KeyError
+                self.assertEqual(User.objects.filter(name='Committed').count(), 1)
+            finally:
+                User.meta = User.meta._replace(connection=self.connection_singleton)
+                pool.close()
+        finally:
+            set_cache(None)
+
+    def test_atomic(self):
+        """ Check that atomic() commits its writes as a whole, and that savepoints roll back nested blocks. """
+
+        with atomic():
+            User(name='Alice').save()
+            with self.assertRaises(KeyError):
+                with atomic():
+                    User(name='Bob').save()
+                    raise KeyError
+            User(name='Carol').save()
+
+        self.assertEqual(sorted(User.objects.values_list('name', flat=True)), ['Alice', 'Carol'])
+
+        with self.assertRaises(RuntimeError):
+            with atomic():
+                User(name='Dave').save()
+                raise RuntimeError
+        self.assertFalse(User.objects.filter(name='Dave').exists())
+
+    def test_schema_cache(self):
+        """ Check that connect_orm() caches the introspected schema, and uses it on the next start. """
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'schema.json')
+
+            connect_orm(self.connection_singleton, DATABASE_NAME, schema_cache=path)
+            with open(path) as file:
+                self.assertIn('User', json.load(file)['foreignkey_relationships'])
+
+            foreignkey_relationships.clear()
+            connect_orm(self.connection_singleton, DATABASE_NAME, schema_cache=path)
+            self.assertEqual(foreignkey_relationships['User']['NotSQLGroupID'], ('NotSQLGroup', 'NotSQLGroupID'))
+
+    def test_indexes(self):
+        """ Check that create_tables() creates declared indexes, and adds them to existing tables when missing. """
+        cursor = self.connection_singleton.cursor
+        backend = self.connection_singleton.backend
+
+        def indexed_columns() -> set[tuple[str, ...]]:
+            return set(backend.indexes(cursor, DATABASE_NAME, 'User'))
+
+        self.assertIn(('name',), indexed_columns())
+
+        cursor.execute(backend.drop_index(DATABASE_NAME, 'User', 'ix_User_name'))
+        self.assertNotIn(('name',), indexed_columns())
+
+        create_tables(self.connection_singleton, DATABASE_NAME)
+        self.assertIn(('name',), indexed_columns())
+
+    def test_duplicate_indexes(self):
+        """ Check that an index declared by both a field and the Meta class is created once. """
+
+        class Tag(DBModel):
+            label: str = StringField(64, index=True)
+
+            class Meta:
+                indexes = ('label',)
+                unique_together = (('label',),)
+
+        try:
+            self.assertEqual(Tag._indexes, (Index(('label',)), Index(('label',), unique=True)))
+            create_tables(self.connection_singleton, DATABASE_NAME)
+            self.assertIn(('label',), set(self.connection_singleton.backend.indexes(self.connection_singleton.cursor, DATABASE_NAME, 'Tag')))
+        finally:
+            del Models['Tag']
+
+    def test_instrumentation(self):
+        """ Check that statements are reported to hooks and collectors, and that lazy foreign keys warn about N+1 queries. """
+
+        # Setup phase
+        group = NotSQLGroup(name='Admins')
+        group.save()
+        User.objects.bulk_create(User(name=str(i), group=group) for i in range(3))
+
+        events = []
+        instrumentation.register(post_execute=events.append)
+        try:
+            with instrumentation.collect(n_plus_one=2) as log:
+                users = list(User.objects)
+                with self.assertWarns(NPlusOneWarning):
+                    for user in users:
+                        user.group
+        finally:
+            instrumentation.unregister(post_execute=events.append)
+
+        self.assertEqual(log.count, 4)  # One query for the users, and one for each of their groups.
+        self.assertEqual(log.lazy_loads[('User', 'group')], 3)
+        self.assertEqual(events, log.queries)
+        self.assertEqual(events[0].rowcount, 3)
+        self.assertIs(events[0].model, User)
+
+        with instrumentation.collect() as log:
+            list(User.objects.select_related('group'))
+        self.assertEqual(log.count, 1)
+
+
+    def test_replica_router(self):
+        """ Check that a ReplicaRouter sends reads to replicas, unless they must see the writes of the primary. """
+
+        # Setup phase
+        replica = ConnectionPool(self.connect, size=1, backend=self.connection_singleton.backend)
+        connect_orm(ReplicaRouter(self.connection_singleton, [replica]), DATABASE_NAME)
+
+        try:
+            User(name='Alice').save()
+            self.assertEqual(replica.stats().checkouts, 0)  # Writes go to the primary.
+
+            self.assertEqual(User.objects.get(name='Alice').name, 'Alice')
+            self.assertEqual(replica.stats().checkouts, 1)
+
+            User.objects.using_primary().count()
+            with atomic():
+                User.objects.count()
+            self.assertEqual(replica.stats().checkouts, 1)
+
+            with sticky():
+                User.objects.count()
+                self.assertEqual(replica.stats().checkouts, 2)
+                User(name='Bob').save()
+                self.assertEqual(User.objects.count(), 2)  # Read from the primary, once the block has written.
+            self.assertEqual(replica.stats().checkouts, 2)
+        finally:
+            connect_orm(self.connection_singleton, DATABASE_NAME)
+            replica.close()
+
+    def test_replica_router_cache(self):
+        """ Check that reads of the primary aren't served rows cached from a lagging replica. """
+
+        # Setup phase, the replica is a database of its own which never catches up.
+        replica = DatabaseConnection(self.connect_shard(0))
+        create_tables(replica, DATABASE_NAME)
+        connect_orm(ReplicaRouter(self.connection_singleton, [replica]), DATABASE_NAME)
+        set_cache(QueryCache(MemoryCache(), ttl={User: 60}))
+
+        try:
+            User(name='New').save()
+            self.assertEqual(list(User.objects.values_list('name', flat=True)), [])  # Cached from the replica.
+            self.assertEqual(list(User.objects.using_primary().values_list('name', flat=True)), ['New'])
+            with sticky():
+                User(name='Newer').save()
+                self.assertEqual(list(User.objects.values_list('name', flat=True)), ['New', 'Newer'])
+        finally:
+            set_cache(None)
+            connect_orm(self.connection_singleton, DATABASE_NAME)
+            replica.close()
+
+    def test_sharding(self):
+        """ Check that sharded rows are placed on the shard of their key, and read from the shards which may hold them. """
+
+        # Setup phase
+        sharding = HashSharding('group', [DatabaseConnection(self.connect_shard(shard)) for shard in range(2)])
+        create_tables(self.connection_singleton, DATABASE_NAME, shards={User: sharding})
+        connect_orm(self.connection_singleton, DATABASE_NAME, shards={User: sharding})
+
+        try:
+            group_a, group_b = NotSQLGroup.objects.bulk_create([NotSQLGroup(name='a'), NotSQLGroup(name='b')])
+            carol = User(name='Carol', group=group_a)
+            carol.save()
+            alice, bob = User.objects.bulk_create([User(name='Alice', group=group_b), User(name='Bob', group=group_a)])
+
+            self.assertEqual(sharding.shard_of_pk(alice.pk), sharding.shard_of_key(group_b.pk))
+            self.assertEqual(sharding.shard_of_pk(bob.pk), sharding.shard_of_key(group_a.pk))
+            self.assertEqual(sharding.shard_of_pk(carol.pk), sharding.shard_of_key(group_a.pk))
+            self.assertNotEqual(sharding.shard_of_pk(alice.pk), sharding.shard_of_pk(bob.pk))
+
+            with instrumentation.collect() as log:
+                self.assertEqual(User.objects.get(pk=alice.pk).group.name, 'b')
+                self.assertEqual(User.objects.filter(group=group_a).count(), 2)
+            self.assertEqual(log.count, 3)  # A single shard each, and the group of Alice from the main database.
+
+            self.assertEqual([user.name for user in User.objects.order_by('name')], ['Alice', 'Bob', 'Carol'])
+            self.assertEqual(list(User.objects.order_by('-name').values_list('name', flat=True)), ['Carol', 'Bob', 'Alice'])
+            self.assertEqual([user.name for user in User.objects.order_by('name').iterator(chunk_size=1)], ['Alice', 'Bob', 'Carol'])
+
+            # Strings are merged by the collation of the backend; case insensitive for MySQL, by code point for SQLite.
+            shard_rows = [[('alice',), ('Émile',)], [('Bob',), ('carol',)]]
+            self.assertEqual([row[0] for row in merge(shard_rows, ((0, False),), MYSQL.sort_key)], ['alice', 'Bob', 'carol', 'Émile'])
+            self.assertEqual([row[0] for row in merge(shard_rows, ((0, False),), SQLITE.sort_key)], ['Bob', 'alice', 'carol', 'Émile'])
+            aaron = User(name='aaron', group=group_b)
+            aaron.save()
+            self.assertEqual(list(User.objects.order_by('name').values_list('name', flat=True)),
+                             ['aaron', 'Alice', 'Bob', 'Carol'] if self.connection_singleton.backend is MYSQL else ['Alice', 'Bob', 'Carol', 'aaron'])
+            aaron.delete()
+
+            self.assertEqual(User.objects.filter(name='Bob').update(name='Robert'), 1)
+            with self.assertRaises(ValueError):
+                User.objects.update(group=group_b)
+            with self.assertRaises(ValueError):
+                User.objects.select_related('group')
+
+            alice.delete()
+            self.assertEqual(User.objects.count(), 2)
+            self.assertFalse(User.objects.filter(name='Alice').exists())
+        finally:
+            connect_orm(self.connection_singleton, DATABASE_NAME)
+            sharding.close()
+
+
+class TestOrmSQLite(TestOrm):
+    """ Runs every test against an in-process SQLite database, which needs neither Docker nor a MySQL server. """
+    directory: TemporaryDirectory
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.connection_singleton = ConnectionSingleton(self.connect())
+
+        create_tables(self.connection_singleton, DATABASE_NAME)
+        connect_orm(self.connection_singleton, DATABASE_NAME)
+
+    def connect(self) -> sqlite3.Connection:
+        # A file rather than :memory:, such that the connections of a pool share the database.
+        return sqlite3.connect(join(self.directory.name, f"{DATABASE_NAME}.db"), check_same_thread=False)
+
+    def connect_shard(self, shard: int) -> sqlite3.Connection:
+        return sqlite3.connect(join(self.directory.name, f"{DATABASE_NAME}_shard{shard}.db"), check_same_thread=False)
+
+    def tearDown(self) -> None:
+        self._disconnect()
+        self.directory.cleanup()
+
 
 if __name__ == '__main__':
     unittest.main()